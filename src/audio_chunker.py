@@ -0,0 +1,73 @@
+from typing import List, Tuple
+
+import numpy as np
+
+# Energy is measured over windows of this length, in seconds, and smoothed over
+# the shortest pause worth cutting at.
+ENERGY_WINDOW = 0.02
+SILENCE_LENGTH = 0.3
+# By default, chunks overlap by this fraction of their length, and are cut within
+# the last fraction of it.
+OVERLAP_FRACTION = 1 / 12
+SEARCH_FRACTION = 1 / 6
+MIN_CHUNK_LENGTH = 10
+
+
+def window_energy(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Smoothed mean energy of the PCM samples in consecutive windows."""
+    window = max(int(ENERGY_WINDOW * sample_rate), 1)
+    count = len(samples) // window
+    if count == 0:
+        return np.zeros(0, np.float32)
+
+    energy = (
+        samples[: count * window].astype(np.float32).reshape(count, window) ** 2
+    ).mean(axis=1)
+
+    smoothing = max(int(SILENCE_LENGTH / ENERGY_WINDOW), 1)
+    return np.convolve(energy, np.ones(smoothing) / smoothing, mode="same")
+
+
+def chunk_bounds(
+    samples: np.ndarray,
+    sample_rate: int,
+    chunk_length: float = 60,
+    overlap: float = None,
+    search: float = None,
+) -> List[Tuple[int, int]]:
+    """
+    Splits the audio into chunks of about `chunk_length` seconds, as (start, end)
+    sample indices. Chunks start and end at the quietest point of the last `search`
+    seconds, so words are not cut, and consecutive chunks overlap by about `overlap`
+    seconds, so that speakers can be matched across them.
+    """
+    if overlap is None:
+        overlap = chunk_length * OVERLAP_FRACTION
+    if search is None:
+        search = chunk_length * SEARCH_FRACTION
+    if chunk_length < MIN_CHUNK_LENGTH:
+        raise ValueError(f"Chunks must be at least {MIN_CHUNK_LENGTH} seconds long")
+    # Otherwise, the next chunk could start before the previous one.
+    if min(overlap, search) < ENERGY_WINDOW or search + 2 * overlap >= chunk_length:
+        raise ValueError("Chunks must be longer than the search and twice the overlap")
+
+    window = max(int(ENERGY_WINDOW * sample_rate), 1)
+    energy = window_energy(samples, sample_rate)
+    length, search = int(chunk_length / ENERGY_WINDOW), int(search / ENERGY_WINDOW)
+    overlap = int(overlap / ENERGY_WINDOW)
+
+    def quietest(start: int, end: int) -> int:
+        # The latest of the quietest windows, to keep chunks long.
+        return end - 1 - int(np.argmin(energy[start:end][::-1]))
+
+    bounds = []
+    start = 0
+    while len(energy) - start > length:
+        end = quietest(start + length - search, start + length)
+        bounds.append((start * window, end * window))
+        start = quietest(
+            max(end - 2 * overlap, start + 1), max(end - overlap // 2, start + 2)
+        )
+
+    bounds.append((start * window, len(samples)))
+    return bounds
@@ -0,0 +1,718 @@
+import json
+import os
+import pickle
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from audio_chunker import MIN_CHUNK_LENGTH, chunk_bounds
+from face_detector import FaceDetector, FaceTracker
+from keyframe_memo import KeyframeMemo, dhash
+from keyframe_scorer import best_frame_index, create_thumbnails, thumbnail_size
+from layout_generator import LayoutGenerator
+from parallel_pipeline import ParallelPipeline
+from pipeline_stages import (
+    FACE_DETECTION_SIZE,
+    FACE_DETECTOR_BACKEND,
+    choose_crop,
+    convert_keyframe_to_obj,
+    create_face_detector,
+    crop_keyframe,
+    detect_speaker,
+    segment_stages,
+    style_transfers,
+    transfer_keyframes_style,
+)
+from result_cache import ResultCache, file_digest, write_atomically
+from structures import Segment, SegmentTable
+from transcription import split_utterances, stitch_utterances
+from transcription_service import (
+    DeepgramBackend,
+    ReplayBackend,
+    TranscriptCache,
+    TranscriptionService,
+)
+from video_processor import (
+    PCM_AUDIO_PROFILE,
+    TRANSCRIPTION_AUDIO_PROFILE,
+    AudioProfile,
+    SceneIndex,
+    Video,
+)
+
+load_dotenv(".secrets")
+
+PRODUCTION = os.environ.get("ENV") == "production"
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", os.cpu_count()))
+# Keyframes are styled this many at a time, and their panels streamed once styled.
+PANEL_BATCH_SIZE = int(os.environ.get("PANEL_BATCH_SIZE", 2 * PIPELINE_WORKERS))
+FACE_DETECTION_INTERVAL = int(os.environ.get("FACE_DETECTION_INTERVAL", 5))
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_MB", 1000)) * 1000 * 1000
+VIDEO_FPS = 2
+# "deepgram", or "replay" to replay recorded transcripts offline.
+TRANSCRIPTION_BACKEND = os.environ.get("TRANSCRIPTION_BACKEND", "deepgram")
+TRANSCRIPTION_TIMEOUT = float(os.environ.get("TRANSCRIPTION_TIMEOUT", 120))
+TRANSCRIPTION_RETRIES = int(os.environ.get("TRANSCRIPTION_RETRIES", 2))
+TRANSCRIPT_CACHE_TTL = float(os.environ.get("TRANSCRIPT_CACHE_TTL", 7 * 24 * 3600))
+# Audio is transcribed in concurrent chunks of about this many seconds, 0 to disable.
+TRANSCRIPTION_CHUNK_LENGTH = float(os.environ.get("TRANSCRIPTION_CHUNK_LENGTH", 60))
+if 0 < TRANSCRIPTION_CHUNK_LENGTH < MIN_CHUNK_LENGTH:
+    raise ValueError(f"TRANSCRIPTION_CHUNK_LENGTH must be 0 or {MIN_CHUNK_LENGTH}+")
+TRANSCRIPTION_CONCURRENCY = int(os.environ.get("TRANSCRIPTION_CONCURRENCY", 4))
+MAX_VIDEO_DURATION = float(os.environ.get("MAX_VIDEO_DURATION", 600))
+# Panels are rendered at this many pixels per unit of the comic's width.
+PANEL_DPI_SCALE = float(os.environ.get("PANEL_DPI_SCALE", 2))
+PANEL_FORMAT = os.environ.get("PANEL_FORMAT", "jpeg")
+PANEL_QUALITY = int(os.environ.get("PANEL_QUALITY", 85))
+# "external" to write panels as separate, cacheable files, or "inline" in the SVG.
+# External panels are shared by the comics in the upload folder, and, like them,
+# are not evicted with the result cache, which would break the comics served.
+PANEL_ASSETS = os.environ.get("PANEL_ASSETS", "external")
+# Comics are named with this prefix, and only they and their panels are served from
+# the upload folder.
+COMIC_PREFIX = "out"
+# Long comics are split into pages of at most this many rows, or this height, which
+# are served as they are rendered. 0 for a single page.
+COMIC_ROWS_PER_PAGE = int(os.environ.get("COMIC_ROWS_PER_PAGE", 0))
+COMIC_PAGE_HEIGHT = float(os.environ.get("COMIC_PAGE_HEIGHT", 0))
+
+UPLOAD_FOLDER = (Path(".") / "uploads").resolve()
+
+result_cache = ResultCache(UPLOAD_FOLDER / "cache", RESULT_CACHE_SIZE)
+
+
+def create_transcription_service() -> TranscriptionService:
+    transcripts = UPLOAD_FOLDER / "transcripts"
+    if TRANSCRIPTION_BACKEND == "replay":
+        # Replays the cached transcripts by default, which are then left untouched.
+        backend = ReplayBackend(os.environ.get("TRANSCRIPTION_REPLAY_DIR", transcripts))
+        cache = None
+    else:
+        backend = DeepgramBackend(os.getenv("DEEPGRAM_API_KEY"))
+        cache = TranscriptCache(transcripts, TRANSCRIPT_CACHE_TTL)
+
+    return TranscriptionService(
+        backend,
+        cache,
+        timeout=TRANSCRIPTION_TIMEOUT,
+        retries=TRANSCRIPTION_RETRIES,
+        concurrency=TRANSCRIPTION_CONCURRENCY,
+    )
+
+
+# One per server process, shared by its job workers.
+transcription_service = create_transcription_service()
+
+
+def ignore_progress(event: dict) -> None:
+    """The default progress callback, for runs outside the job queue."""
+
+
+def pipe(
+    *functions: Callable[[Segment], None]
+) -> Callable[[List[Segment]], List[Segment]]:
+    """Implements function composition."""
+
+    def pipeline(segments):
+        for segment in segments:
+            for function in functions:
+                function(segment)
+
+        return segments
+
+    return pipeline
+
+
+def select_key_frame_indices(
+    video: Video,
+    thumbnails: np.ndarray,
+    segments: List[Segment],
+    faces: Dict[int, list],
+) -> List[Segment]:
+    """
+    Picks the keyframes from the segments' timestamps and the thumbnails of all the
+    video's frames, without decoding the frames themselves. Segments whose frames
+    all have tracked `faces`, by frame index, are given them, to prefer frames with
+    faces.
+    """
+    table = SegmentTable.from_segments(segments)
+    starts, stops = video.get_frame_ranges(table.start, table.end)
+    stops = np.minimum(stops, len(thumbnails))
+
+    # Counts the frames with faces in every range at once.
+    has_faces = np.zeros(len(thumbnails) + 1, np.int64)
+    has_faces[[index + 1 for index in faces if index < len(thumbnails)]] = 1
+    has_faces = np.cumsum(has_faces)
+    covered = (stops > starts) & (
+        has_faces[stops] - has_faces[starts] == stops - starts
+    )
+
+    for segment, start, stop, full in zip(
+        segments, starts.tolist(), stops.tolist(), covered.tolist()
+    ):
+        if full:
+            segment.faces = [faces[index] for index in range(start, stop)]
+        segment.keyframe_index = (
+            best_frame_index(thumbnails[start:stop], segment.faces)
+            if stop > start
+            else 0
+        )
+
+    return segments
+
+
+def get_video_frame_index(video: Video, segment: Segment) -> int:
+    return video.get_frame_indices(segment.start, segment.end)[segment.keyframe_index]
+
+
+def assign_frame_index(video: Video):
+    def assign_to_segment(segment: Segment) -> None:
+        segment.frame_index = get_video_frame_index(video, segment)
+
+    return assign_to_segment
+
+
+def attach_keyframe(video: Video, frames: Iterator[Tuple[int, np.ndarray]]):
+    """
+    Attaches the keyframes from `frames`, streamed by frame index in order, only
+    holding those decoded ahead of the segment being attached. Keyframes missing
+    from the stream are decoded on their own.
+    """
+    decoded = {}
+
+    def attach_to_segment(segment: Segment) -> None:
+        for frame_index, frame in frames:
+            decoded[frame_index] = frame
+            if frame_index >= segment.frame_index:
+                break
+
+        segment.keyframe = decoded.pop(segment.frame_index, None)
+        if segment.keyframe is None:
+            segment.keyframe = video.get_frame(segment.frame_index)
+
+    return attach_to_segment
+
+
+def attach_detected_speakers(detections: Dict[int, tuple]):
+    """Reuses the speakers already detected in the keyframe, by frame index."""
+
+    def attach_to_segment(segment: Segment) -> None:
+        if segment.frame_index in detections:
+            speaker_location, speakers_bbox = detections[segment.frame_index]
+            # Copied, as the bounding boxes are later adjusted to the crop.
+            segment.speaker_location = speaker_location.copy()
+            segment.speakers_bbox = speakers_bbox.copy()
+
+    return attach_to_segment
+
+
+def assign_shot(scenes: SceneIndex):
+    def assign_to_segment(segment: Segment) -> None:
+        segment.shot = scenes.shot_of_frame(segment.frame_index)
+
+    return assign_to_segment
+
+
+def share_within_shots(
+    segments: List[Segment],
+    detect: Callable[[List[Segment]], List[Segment]],
+    width: int,
+    shot_speakers: Dict[int, tuple],
+) -> List[Segment]:
+    """
+    Segments of the same shot reuse the speakers found for one of them, and the
+    same crop. Speakers are only detected once per shot, where not already known,
+    with `detect` called on all the new shots' references at once. The speakers and
+    crop of the shots seen so far are kept in `shot_speakers`, by shot, so that the
+    segments can be passed a batch at a time.
+    """
+    shots = {}
+    for segment in segments:
+        if segment.shot not in shot_speakers:
+            shots.setdefault(segment.shot, []).append(segment)
+
+    references = [
+        next(
+            (segment for segment in shot_segments if segment.speakers_bbox is not None),
+            shot_segments[0],
+        )
+        for shot_segments in shots.values()
+    ]
+    undetected = [
+        reference for reference in references if reference.speakers_bbox is None
+    ]
+    # The detected segments may be copies, e.g. from another process.
+    for reference, detected in zip(undetected, detect(undetected)):
+        reference.speaker_location = detected.speaker_location
+        reference.speakers_bbox = detected.speakers_bbox
+
+    # Copied, as the bounding boxes are later adjusted to the crop.
+    for reference in references:
+        shot_speakers[reference.shot] = (
+            reference.speaker_location.copy(),
+            reference.speakers_bbox.copy(),
+            choose_crop(reference, width),
+        )
+
+    for segment in segments:
+        speaker_location, speakers_bbox, segment.crop = shot_speakers[segment.shot]
+        if segment.speakers_bbox is None:
+            segment.speaker_location = speaker_location.copy()
+            segment.speakers_bbox = speakers_bbox.copy()
+
+    return segments
+
+
+def find_duplicate_keyframes(
+    segments: List[Segment], thumbnails: np.ndarray, memo: KeyframeMemo
+) -> List[Optional[int]]:
+    """
+    For each segment, the index of the first segment with a near-duplicate keyframe,
+    by perceptual hash of its thumbnail, or None if it is the first. The duplicates
+    reuse its speakers, crop and panel image, so their keyframes are never decoded.
+    """
+    duplicate_of = []
+    for index, segment in enumerate(segments):
+        if segment.frame_index >= len(thumbnails):
+            duplicate_of.append(None)
+            continue
+
+        keyframe_hash = dhash(thumbnails[segment.frame_index])
+        first = memo.get(keyframe_hash)
+        if first is None:
+            memo.add(keyframe_hash, index)
+        duplicate_of.append(first)
+
+    return duplicate_of
+
+
+def share_panel(first: Segment, segment: Segment) -> None:
+    segment.speaker_location = first.speaker_location.copy()
+    segment.speakers_bbox = first.speakers_bbox.copy()
+    segment.crop = first.crop
+    segment.keyframe_cropped = True
+    segment.keyframe_styled = True
+    segment.image = first.image.share()
+
+
+# Its workers are started on first use.
+if PIPELINE_WORKERS > 1:
+    parallel_pipeline = ParallelPipeline(segment_stages, workers=PIPELINE_WORKERS)
+
+
+def transcribe_video(path: str, audio_profile: AudioProfile) -> list:
+    """
+    Long audio is split at silences into chunks, which are encoded and transcribed
+    concurrently, and stitched back together.
+    """
+    if not TRANSCRIPTION_CHUNK_LENGTH:
+        audio = Video.load_audio(path, audio_profile)
+        return split_utterances(
+            transcription_service.transcribe(audio, audio_profile.mimetype)
+        )
+
+    samples = np.frombuffer(Video.load_audio(path, PCM_AUDIO_PROFILE), np.int16)
+    sample_rate = PCM_AUDIO_PROFILE.sample_rate
+    bounds = chunk_bounds(samples, sample_rate, TRANSCRIPTION_CHUNK_LENGTH)
+
+    with ThreadPoolExecutor(min(len(bounds), TRANSCRIPTION_CONCURRENCY)) as executor:
+        audios = list(
+            executor.map(
+                lambda bound: Video.encode_audio(
+                    samples[bound[0] : bound[1]].tobytes(), audio_profile
+                ),
+                bounds,
+            )
+        )
+    chunks = transcription_service.transcribe_all(audios, audio_profile.mimetype)
+
+    return split_utterances(
+        stitch_utterances(
+            [
+                (start / sample_rate, end / sample_rate, utterances)
+                for (start, end), utterances in zip(bounds, chunks)
+            ]
+        )
+    )
+
+
+def scan_frames(
+    video: Video, face_detector: FaceDetector, done: Future
+) -> Tuple[np.ndarray, SceneIndex, Dict[int, list], Dict[int, tuple]]:
+    """
+    Decodes the frames once, in order, into the thumbnails of all of them and their
+    shots, and, speculatively until `done` completes, the faces and the speakers in
+    them, by frame index. Faces are tracked between detections, within shots.
+    """
+    thumbnails = []
+    boundaries = [0]
+    faces = {}
+    detections = {}
+    face_tracker = FaceTracker(face_detector, FACE_DETECTION_INTERVAL)
+
+    frames = Video.iter_frames(video.path, video.height, video.width, video.fps)
+    try:
+        for index, frame in enumerate(frames):
+            thumbnails.append(create_thumbnails(frame[None])[0])
+            cut = index > 0 and SceneIndex.is_cut(thumbnails[-2], thumbnails[-1])
+            if cut:
+                boundaries.append(index)
+            if done.done():
+                continue
+
+            if cut:
+                face_tracker.reset()
+            faces[index] = face_tracker(frame)
+            detections[index] = FaceDetector.find_speaker_face_from(frame, faces[index])
+    finally:
+        frames.close()
+
+    scenes = SceneIndex(boundaries, video.fps, len(thumbnails))
+    shape = (len(thumbnails), *thumbnail_size(video.height, video.width))
+    return np.array(thumbnails, np.uint8).reshape(shape), scenes, faces, detections
+
+
+def transcript_config() -> dict:
+    """Everything besides the video that the transcript depends on."""
+    return {
+        "audio_profile": TRANSCRIPTION_AUDIO_PROFILE,
+        "chunk_length": TRANSCRIPTION_CHUNK_LENGTH,
+    }
+
+
+def pipeline_config(quality: str) -> dict:
+    """Everything besides the video that the panels and the comic depend on."""
+    return {
+        "quality": quality,
+        "fps": VIDEO_FPS,
+        # The panels' speech bubbles and timing come from the transcript.
+        "transcript": transcript_config(),
+        "face_detector": [
+            FACE_DETECTOR_BACKEND,
+            FACE_DETECTION_SIZE,
+            FACE_DETECTION_INTERVAL,
+        ],
+        "panels": [PANEL_DPI_SCALE, PANEL_FORMAT, PANEL_QUALITY, PANEL_ASSETS],
+        # Changed when the pickled panels' structure changes.
+        "version": 5,
+    }
+
+
+def comic_config(quality: str) -> dict:
+    """Everything besides the video that the rendered comic depends on."""
+    return {
+        **pipeline_config(quality),
+        "pages": [COMIC_ROWS_PER_PAGE, COMIC_PAGE_HEIGHT],
+    }
+
+
+def create_panels(
+    path: str,
+    digest: str,
+    quality: str,
+    stats: dict,
+    batch_size: int = None,
+    on_panels: Callable[[List[Segment]], None] = None,
+    progress: Callable[[dict], None] = ignore_progress,
+) -> List[Segment]:
+    """
+    The segments of the video, with their panel images. If `batch_size` is given,
+    the keyframes are styled that many at a time, and `on_panels` is called with
+    each batch as soon as its panels are ready. The start of each stage is passed
+    to `progress`.
+    """
+    progress({"type": "stage", "stage": "transcription"})
+    video = Video(
+        path,
+        fps=VIDEO_FPS,
+        lazy=True,
+        audio_profile=TRANSCRIPTION_AUDIO_PROFILE,
+        with_audio=False,
+        max_duration=MAX_VIDEO_DURATION,
+    )
+    face_detector = create_face_detector()
+
+    transcript_key = result_cache.key(digest, "transcript", transcript_config())
+    cached_transcript = result_cache.get(transcript_key)
+    stats["cache"]["transcript"] = cached_transcript is not None
+
+    # The transcription request is started first, and the frames are scanned while it
+    # is in flight. The audio is decoded by its own ffmpeg process rather than with
+    # the frames (see `Video.demux`), so that it is not paced by the frame scan.
+    with ThreadPoolExecutor(1) as executor:
+        if cached_transcript is not None:
+            transcription = Future()
+            transcription.set_result(json.loads(cached_transcript))
+        else:
+            transcription = executor.submit(transcribe_video, path, video.audio_profile)
+        thumbnails, scenes, faces, detections = scan_frames(
+            video, face_detector, transcription
+        )
+        utterances = transcription.result()
+
+    if cached_transcript is None:
+        result_cache.put(transcript_key, json.dumps(utterances).encode())
+
+    if not PRODUCTION:
+        with open("transcript.json", "w") as file:
+            json.dump(utterances, file, indent=4)
+
+    progress({"type": "stage", "stage": "keyframes"})
+
+    segments = select_key_frame_indices(
+        video,
+        thumbnails,
+        [Segment(**utterance_segment) for utterance_segment in utterances],
+        faces,
+    )
+    segments = pipe(
+        assign_frame_index(video),
+        assign_shot(scenes),
+        attach_detected_speakers(detections),
+    )(segments)
+    keyframe_memo = KeyframeMemo()
+    duplicate_of = find_duplicate_keyframes(segments, thumbnails, keyframe_memo)
+
+    if PIPELINE_WORKERS > 1:
+        detect = partial(parallel_pipeline, detect_only=True)
+    else:
+        detect = pipe(detect_speaker(face_detector))
+    shot_speakers = {}
+
+    # The keyframes are decoded in a single ffmpeg call, but only held for a batch.
+    frame_indices = sorted(
+        {
+            segment.frame_index
+            for segment, first in zip(segments, duplicate_of)
+            if first is None
+        }
+    )
+    frames = Video.load_frames_at(
+        video.path, video.height, video.width, video.fps, frame_indices
+    )
+    attach = pipe(attach_keyframe(video, zip(frame_indices, frames)))
+
+    progress({"type": "stage", "stage": "styling", "segments": len(segments)})
+    batch_size = batch_size or max(len(segments), 1)
+    try:
+        for start in range(0, len(segments), batch_size):
+            indices = range(start, min(start + batch_size, len(segments)))
+            batch = attach(
+                [segments[index] for index in indices if duplicate_of[index] is None]
+            )
+            share_within_shots(batch, detect, video.width, shot_speakers)
+            if PIPELINE_WORKERS > 1:
+                batch = parallel_pipeline(batch, quality=quality)
+            else:
+                batch = pipe(detect_speaker(face_detector), crop_keyframe)(batch)
+                batch = transfer_keyframes_style(batch, style_transfers[quality])
+                batch = pipe(convert_keyframe_to_obj)(batch)
+
+            # The segments may be copies, e.g. from another process.
+            batch = iter(batch)
+            for index in indices:
+                if duplicate_of[index] is None:
+                    segments[index] = next(batch)
+                    segments[index].keyframe = None
+                else:
+                    share_panel(segments[duplicate_of[index]], segments[index])
+
+            if on_panels is not None:
+                on_panels(segments[start : start + batch_size])
+    finally:
+        frames.close()
+
+    stats["keyframe_memo"] = keyframe_memo.stats()
+    return segments
+
+
+def create_layout() -> LayoutGenerator:
+    return LayoutGenerator(
+        PANEL_DPI_SCALE,
+        PANEL_FORMAT,
+        PANEL_QUALITY,
+        asset_directory=(UPLOAD_FOLDER if PANEL_ASSETS == "external" else None),
+        asset_url="/uploads/",
+        rows_per_page=COMIC_ROWS_PER_PAGE,
+        page_height=COMIC_PAGE_HEIGHT,
+    )
+
+
+def stream_panels(
+    layout: LayoutGenerator, progress: Callable[[dict], None]
+) -> Callable[[List[Segment]], None]:
+    """
+    Adds segments to the layout, and passes each of their panels to `progress` as
+    a "panel" event, so that clients can draw them before the comic is rendered.
+    """
+
+    def add_segments(segments: List[Segment]) -> None:
+        start = len(layout.frames)
+        if start == 0:
+            progress({"type": "layout", "width": layout.width, "margin": layout.margin})
+        for segment in segments:
+            layout.add_frame(segment)
+
+        for panel in layout.iter_panels(start):
+            progress({"type": "panel", **panel})
+
+    return add_segments
+
+
+def page_renderer(
+    layout: LayoutGenerator, name: str, report: Callable[[str], None] = None
+) -> Callable[..., List[dict]]:
+    """
+    Renders the pages of the comic as frames are added to the layout, into files
+    named after `name`, and lists them in the index `name`.json. A page is rendered
+    once the frames after it start the next page, or once the comic is `complete`.
+    The index is reported as soon as it lists the first page.
+    """
+    directory = UPLOAD_FOLDER
+    pages = []
+
+    def render(complete: bool = False) -> List[dict]:
+        index = layout.page_index()
+        for page in range(len(pages), len(index) if complete else len(index) - 1):
+            page_name = f"{name}-{page + 1}.svg"
+            layout.render_frames_to_image(directory / page_name, page)
+            pages.append({**index[page], "name": page_name})
+
+        # Replaced atomically, as it is read while the comic is being rendered.
+        write_atomically(
+            directory / f"{name}.json",
+            json.dumps({"pages": pages, "complete": complete}).encode(),
+        )
+
+        if pages and report is not None:
+            report(f"{name}.json")
+        return pages
+
+    return render
+
+
+def get_panels(
+    path: str,
+    digest: str,
+    quality: str,
+    stats: dict,
+    on_panels: Callable[[List[Segment]], None],
+    progress: Callable[[dict], None],
+) -> List[Segment]:
+    """`create_panels`, in batches, unless the panels of the video are cached."""
+    panels_key = result_cache.key(digest, "panels", pipeline_config(quality))
+    panels = result_cache.get(panels_key)
+    stats["cache"]["panels"] = panels is not None
+    if panels is not None:
+        segments = pickle.loads(panels)
+        on_panels(segments)
+        return segments
+
+    segments = create_panels(
+        path,
+        digest,
+        quality,
+        stats,
+        batch_size=PANEL_BATCH_SIZE,
+        on_panels=on_panels,
+        progress=progress,
+    )
+    # The panels' pixels are released, but their encodings are kept.
+    result_cache.put(panels_key, pickle.dumps(segments))
+    return segments
+
+
+def process_video(
+    path: str,
+    quality: str = "full",
+    report: Callable[[str], None] = None,
+    progress: Callable[[dict], None] = ignore_progress,
+) -> Tuple[str, dict]:
+    """
+    Renders the video into a comic, returning its name and processing stats.
+    Paginated comics are named by the index of their pages, passed to `report`.
+    The comic of a video rendered before is returned again, while it still exists.
+    """
+    digest = file_digest(path)
+    comic_key = result_cache.key(digest, "comic", comic_config(quality))
+    stats = {"cache": {}}
+
+    comic = result_cache.get(comic_key)
+    stats["cache"]["comic"] = (
+        comic is not None and (UPLOAD_FOLDER / comic.decode()).is_file()
+    )
+    if stats["cache"]["comic"]:
+        return comic.decode(), stats
+
+    layout = create_layout()
+    if layout.page_rows is not None:
+        name, stats = process_video_pages(
+            path, digest, quality, layout, report, progress, stats
+        )
+        result_cache.put(comic_key, name.encode())
+        return name, stats
+
+    fd, comic_path = tempfile.mkstemp(
+        prefix=COMIC_PREFIX, suffix=".svg", dir=UPLOAD_FOLDER
+    )
+    os.close(fd)
+
+    segments = get_panels(
+        path, digest, quality, stats, stream_panels(layout, progress), progress
+    )
+
+    if not PRODUCTION:
+        pickle.dump(segments, open("cache.pickle", "wb+"))
+
+    progress({"type": "stage", "stage": "rendering"})
+    layout.render_frames_to_image(comic_path)
+    name = Path(comic_path).name
+    result_cache.put(comic_key, name.encode())
+
+    stats["segments"] = len(segments)
+    stats["comic_bytes"] = Path(comic_path).stat().st_size
+    stats["panel_bytes"] = layout.image_bytes
+    return name, stats
+
+
+def process_video_pages(
+    path: str,
+    digest: str,
+    quality: str,
+    layout: LayoutGenerator,
+    report: Callable[[str], None],
+    progress: Callable[[dict], None],
+    stats: dict,
+) -> Tuple[str, dict]:
+    """
+    `process_video` for a paginated comic. The keyframes are styled in batches, and
+    each page is rendered as soon as its panels are ready, so only the panel images
+    of about a page are held at once.
+    """
+    # Reserves the index's name, it is written once the first page is rendered.
+    fd, index_path = tempfile.mkstemp(
+        prefix=COMIC_PREFIX, suffix=".json", dir=UPLOAD_FOLDER
+    )
+    os.close(fd)
+    name = Path(index_path).stem
+    render = page_renderer(layout, name, report)
+    add_segments = stream_panels(layout, progress)
+
+    def add_panels(segments: List[Segment]) -> None:
+        add_segments(segments)
+        render()
+
+    segments = get_panels(path, digest, quality, stats, add_panels, progress)
+
+    progress({"type": "stage", "stage": "rendering"})
+    pages = render(complete=True)
+
+    stats["segments"] = len(segments)
+    stats["pages"] = len(pages)
+    stats["panel_bytes"] = layout.image_bytes
+    return f"{name}.json", stats
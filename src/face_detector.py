@@ -1,15 +1,85 @@
 from pathlib import Path
+from typing import List, Tuple
 
 import cv2
 import dlib
+import numpy as np
 from imutils import face_utils
 
 from structures import Rect
 
+OPENCV_FACE_DETECTOR_DIR = Path(__file__).parent / "opencv_face_detector"
 
-class FaceDetector:
-    def __init__(self):
+
+class HogBackend:
+    """dlib's HOG frontal face detector."""
+
+    def __init__(self, upsample: int = 1):
         self.DETECTOR = dlib.get_frontal_face_detector()
+        self.upsample = upsample
+
+    def __call__(self, frame, gray) -> List[Tuple[int, int, int, int]]:
+        return [
+            face_utils.rect_to_bb(rect) for rect in self.DETECTOR(gray, self.upsample)
+        ]
+
+
+class HaarBackend:
+    """OpenCV's Haar cascade, using the model bundled with opencv-python."""
+
+    def __init__(self, scale_factor: float = 1.1, min_neighbors: int = 5):
+        self.DETECTOR = cv2.CascadeClassifier(
+            cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+        )
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    def __call__(self, frame, gray) -> List[Tuple[int, int, int, int]]:
+        faces = self.DETECTOR.detectMultiScale(
+            gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors
+        )
+        return [tuple(map(int, face)) for face in faces]
+
+
+class DnnBackend:
+    """OpenCV's ResNet-10 SSD face detector, see `make download-model`."""
+
+    def __init__(self, confidence: float = 0.5):
+        self.DETECTOR = cv2.dnn.readNetFromCaffe(
+            (OPENCV_FACE_DETECTOR_DIR / "deploy.prototxt").as_posix(),
+            (
+                OPENCV_FACE_DETECTOR_DIR / "res10_300x300_ssd_iter_140000.caffemodel"
+            ).as_posix(),
+        )
+        self.confidence = confidence
+
+    def __call__(self, frame, gray) -> List[Tuple[int, int, int, int]]:
+        height, width = frame.shape[:2]
+        blob = cv2.dnn.blobFromImage(
+            cv2.resize(frame, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0)
+        )
+        self.DETECTOR.setInput(blob)
+        detections = self.DETECTOR.forward()[0, 0]
+
+        faces = []
+        for detection in detections[detections[:, 2] > self.confidence]:
+            box = np.clip(detection[3:7], 0, 1) * [width, height, width, height]
+            x0, y0, x1, y1 = box
+            faces.append((int(x0), int(y0), int(x1 - x0), int(y1 - y0)))
+        return faces
+
+
+FACE_DETECTION_BACKENDS = {"hog": HogBackend, "haar": HaarBackend, "dnn": DnnBackend}
+
+
+class FaceDetector:
+    def __init__(self, backend: str = "hog", detection_size: int = None):
+        """
+        Faces are detected with the named backend from `FACE_DETECTION_BACKENDS`, on
+        the frame downscaled so that its longest side is at most `detection_size`.
+        """
+        self.backend = FACE_DETECTION_BACKENDS[backend]()
+        self.detection_size = detection_size
         # self.PREDICTOR = dlib.shape_predictor(
         #     (
         #         Path(".")
@@ -19,14 +89,31 @@ class FaceDetector:
         #     ).as_posix()
         # )
 
+    def detect_faces(self, frame) -> List[Tuple[int, int, int, int]]:
+        """Bounding boxes of the faces, as (x, y, w, h) in full resolution pixels."""
+        scale = 1.0
+        if self.detection_size and max(frame.shape[:2]) > self.detection_size:
+            scale = self.detection_size / max(frame.shape[:2])
+            frame = cv2.resize(
+                frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return [
+            tuple(int(round(value / scale)) for value in face)
+            for face in self.backend(frame, gray)
+        ]
+
     @staticmethod
     def dist(a, b):
         return ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5
 
     def find_speaker_face(self, frame):
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        rects = self.DETECTOR(gray, 1)
+        return self.find_speaker_face_from(frame, self.detect_faces(frame))
 
+    @staticmethod
+    def find_speaker_face_from(frame, faces: List[Tuple[int, int, int, int]]):
+        """`find_speaker_face` for faces already detected, or tracked, in the frame."""
         # this is the default speaker face position
         speaker_face = Rect(
             ((frame.shape[0] // 2) - 10),
@@ -43,7 +130,7 @@ class FaceDetector:
         min_y = frame.shape[1]
         max_y = 0
 
-        for rect in rects:
+        for x, y, w, h in faces:
             # shape = self.PREDICTOR(gray, rect)
             # shape = face_utils.shape_to_np(shape)
 
@@ -54,8 +141,6 @@ class FaceDetector:
             # )
             # mouth_width = FaceDetector.dist(shape[54], shape[48])
 
-            (x, y, w, h) = face_utils.rect_to_bb(rect)
-
             # extend text exclusion bounding box to include speaker
             if x < min_x:
                 min_x = x
@@ -89,6 +174,73 @@ class FaceDetector:
         return speaker_face, speakers_bb
 
 
+class FaceTracker:
+    """
+    Finds the faces in consecutive frames of a shot: the detector is run every
+    `detection_interval` frames, and the face boxes are tracked in between with sparse
+    optical flow on their corners.
+    """
+
+    def __init__(self, face_detector: FaceDetector, detection_interval: int = 5):
+        self.face_detector = face_detector
+        self.detection_interval = detection_interval
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the tracked faces, e.g. at a shot boundary."""
+        self.previous_gray = None
+        self.faces = []
+        self.frames_since_detection = 0
+
+    def __call__(self, frame) -> List[Tuple[int, int, int, int]]:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        faces = None
+        if (
+            self.previous_gray is not None
+            and self.frames_since_detection < self.detection_interval
+        ):
+            faces = self.track_faces(self.previous_gray, gray, self.faces)
+            self.frames_since_detection += 1
+            if len(faces) < len(self.faces):
+                # A face was lost.
+                faces = None
+
+        if faces is None:
+            faces = self.face_detector.detect_faces(frame)
+            self.frames_since_detection = 1
+
+        self.previous_gray = gray
+        self.faces = faces
+        return faces
+
+    @staticmethod
+    def track_faces(
+        previous_gray, gray, faces: List[Tuple[int, int, int, int]]
+    ) -> List[Tuple[int, int, int, int]]:
+        height, width = gray.shape
+        tracked = []
+        for x, y, w, h in faces:
+            # Corners, edge midpoints and center of the box.
+            points = np.float32(
+                [[x + w * i / 2, y + h * j / 2] for i in range(3) for j in range(3)]
+            ).reshape(-1, 1, 2)
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(
+                previous_gray, gray, points, None
+            )
+
+            found = status.ravel() == 1
+            if found.sum() < len(points) // 2:
+                continue
+
+            dx, dy = np.median((moved - points)[found], axis=0).ravel()
+            x = int(round(min(max(x + dx, 0), width - w)))
+            y = int(round(min(max(y + dy, 0), height - h)))
+            tracked.append((x, y, w, h))
+
+        return tracked
+
+
 if __name__ == "__main__":
     cap = cv2.VideoCapture(0)
     face_detector = FaceDetector()
@@ -0,0 +1,251 @@
+import json
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import closing
+from functools import partial
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue, shared by the server processes and run by worker threads,
+    which call `handler(input_path, report=..., progress=..., **options)`. The events
+    of finished jobs are deleted after `event_retention` seconds, and the jobs after
+    `job_retention` seconds.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        handler: Callable[..., Tuple[str, dict]],
+        workers: int = 2,
+        poll_interval: float = 1.0,
+        lease: float = 60.0,
+        attempts: int = 2,
+        event_retention: float = 600.0,
+        job_retention: float = 7 * 24 * 3600.0,
+    ) -> None:
+        self.database = str(database)
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.attempts = attempts
+        self.event_retention = event_retention
+        self.job_retention = job_retention
+        self._wakeup = threading.Event()
+        self._running = set()
+
+        with closing(self._connect()) as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    input_path TEXT NOT NULL,
+                    options TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    stats TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+                """
+            )
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    data TEXT NOT NULL
+                )
+                """
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS events_job ON events (job_id, id)")
+
+        self.workers = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.database, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def submit(self, input_path: str, **options) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        with closing(self._connect()) as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, input_path, options, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, str(input_path), json.dumps(options), now, now),
+            )
+
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT id, status, result, stats, error FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["stats"] = json.loads(job["stats"]) if job["stats"] is not None else None
+        return job
+
+    def events(self, job_id: str, after: int = 0) -> List[Tuple[int, dict]]:
+        """The job's events logged after the one with id `after`, as (id, event)."""
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                "SELECT id, data FROM events WHERE job_id = ? AND id > ? ORDER BY id",
+                (job_id, after),
+            ).fetchall()
+
+        return [(row["id"], json.loads(row["data"])) for row in rows]
+
+    def _prune(self) -> None:
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                (DONE, FAILED, now - self.job_retention),
+            )
+            db.execute(
+                "DELETE FROM events WHERE job_id NOT IN "
+                "(SELECT id FROM jobs WHERE status NOT IN (?, ?) OR updated >= ?)",
+                (DONE, FAILED, now - self.event_retention),
+            )
+
+    def _heartbeat(self) -> None:
+        """Renews the lease of the jobs run by this process, and prunes old jobs."""
+        while True:
+            time.sleep(self.lease / 4)
+            self._prune()
+            running = list(self._running)
+            if not running:
+                continue
+
+            with closing(self._connect()) as db:
+                db.execute(
+                    f"UPDATE jobs SET updated = ? WHERE status = ? "
+                    f"AND id IN ({', '.join('?' * len(running))})",
+                    (time.time(), RUNNING, *running),
+                )
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            # Jobs whose lease expired were abandoned by a server process that died,
+            # they are retried unless they were already tried too many times.
+            now = time.time()
+            abandoned = db.execute(
+                "SELECT id, input_path FROM jobs "
+                "WHERE status = ? AND updated < ? AND attempts >= ?",
+                (RUNNING, now - self.lease, self.attempts),
+            ).fetchall()
+            for abandoned_job in abandoned:
+                db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+                    (FAILED, "Job was abandoned", now, abandoned_job["id"]),
+                )
+            db.execute(
+                "UPDATE jobs SET status = ?, result = NULL, updated = ? "
+                "WHERE status = ? AND updated < ?",
+                (QUEUED, now, RUNNING, now - self.lease),
+            )
+            job = db.execute(
+                "SELECT id, input_path, options FROM jobs WHERE status = ? "
+                "ORDER BY created LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if job is not None:
+                db.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated = ? "
+                    "WHERE id = ?",
+                    (RUNNING, time.time(), job["id"]),
+                )
+            db.execute("COMMIT")
+
+        for abandoned_job in abandoned:
+            Path(abandoned_job["input_path"]).unlink(missing_ok=True)
+        return job
+
+    def _report(self, job_id: str, result: str) -> None:
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE jobs SET result = ?, updated = ? WHERE id = ? AND status = ?",
+                (result, time.time(), job_id, RUNNING),
+            )
+
+    def _progress(self, job_id: str, event: dict) -> None:
+        with closing(self._connect()) as db:
+            db.execute(
+                "INSERT INTO events (job_id, data) VALUES (?, ?)",
+                (job_id, json.dumps(event)),
+            )
+
+    def _finish(
+        self,
+        job_id: str,
+        status: str,
+        result: str = None,
+        stats: dict = None,
+        error: str = None,
+    ) -> None:
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, stats = ?, error = ?, "
+                "updated = ? WHERE id = ?",
+                (
+                    status,
+                    result,
+                    json.dumps(stats) if stats is not None else None,
+                    error,
+                    time.time(),
+                    job_id,
+                ),
+            )
+
+    def _work(self) -> None:
+        while True:
+            job = self._claim()
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            self._running.add(job["id"])
+            try:
+                result, stats = self.handler(
+                    job["input_path"],
+                    report=partial(self._report, job["id"]),
+                    progress=partial(self._progress, job["id"]),
+                    **json.loads(job["options"]),
+                )
+            except Exception as e:
+                traceback.print_exc()
+                self._finish(job["id"], FAILED, error=str(e))
+            else:
+                self._finish(job["id"], DONE, result=result, stats=stats)
+            finally:
+                self._running.discard(job["id"])
+                Path(job["input_path"]).unlink(missing_ok=True)
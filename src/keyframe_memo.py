@@ -0,0 +1,54 @@
+from typing import Any, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+HASH_SIZE = 8
+# Keyframes whose hashes differ in at most this many bits are near-duplicates.
+DUPLICATE_DISTANCE = 4
+
+
+def dhash(image: np.ndarray, hash_size: int = HASH_SIZE) -> int:
+    """Difference hash of the image, from its downsampled grayscale gradients."""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class KeyframeMemo:
+    """
+    Per request memo of values computed for a keyframe, such as its speakers and
+    styled image, which near-duplicate keyframes can reuse.
+    """
+
+    def __init__(self, max_distance: int = DUPLICATE_DISTANCE) -> None:
+        self.max_distance = max_distance
+        self.entries: List[Tuple[int, Any]] = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, keyframe_hash: int) -> Optional[Any]:
+        for entry_hash, value in self.entries:
+            if hamming_distance(keyframe_hash, entry_hash) <= self.max_distance:
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def add(self, keyframe_hash: int, value: Any) -> None:
+        self.entries.append((keyframe_hash, value))
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}
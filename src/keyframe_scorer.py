@@ -0,0 +1,77 @@
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+# Frames are scored on grayscale thumbnails of this width.
+THUMBNAIL_WIDTH = 160
+
+SHARPNESS_WEIGHT = 1.0
+EXPOSURE_WEIGHT = 0.5
+MOTION_WEIGHT = 1.0
+FACE_WEIGHT = 0.5
+# Mean absolute difference to the neighbouring frames (as a fraction of the range)
+# at which the motion penalty saturates.
+MOTION_SATURATION = 0.1
+
+
+def thumbnail_size(height: int, width: int) -> Tuple[int, int]:
+    return max(round(height * THUMBNAIL_WIDTH / width), 1), THUMBNAIL_WIDTH
+
+
+def create_thumbnails(frames: np.ndarray) -> np.ndarray:
+    """Downscaled grayscale copies of BGR frames."""
+    height, width = thumbnail_size(*frames.shape[1:3])
+    return np.stack(
+        [
+            cv2.cvtColor(
+                cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA),
+                cv2.COLOR_BGR2GRAY,
+            )
+            for frame in frames
+        ]
+    )
+
+
+def score_frames(thumbnails: np.ndarray, faces: List[list] = None) -> np.ndarray:
+    """
+    Scores the quality of each frame of a sequence, from its thumbnail, in one batched
+    pass: sharpness (variance of the Laplacian), exposure and motion relative to the
+    neighbouring frames. If the faces in each frame are known, frames with faces are
+    preferred.
+    """
+    gray = thumbnails.astype(np.float32)
+
+    laplacian = (
+        gray[:, :-2, 1:-1]
+        + gray[:, 2:, 1:-1]
+        + gray[:, 1:-1, :-2]
+        + gray[:, 1:-1, 2:]
+        - 4 * gray[:, 1:-1, 1:-1]
+    )
+    sharpness = laplacian.var(axis=(1, 2))
+    sharpness /= max(sharpness.max(), 1e-6)
+
+    exposure = 1 - 2 * np.abs(gray.mean(axis=(1, 2)) / 255 - 0.5)
+
+    motion = np.zeros(len(gray), np.float32)
+    if len(gray) > 1:
+        difference = np.abs(np.diff(gray, axis=0)).mean(axis=(1, 2)) / 255
+        motion[1:] = difference
+        motion[:-1] = np.maximum(motion[:-1], difference)
+    motion = np.minimum(motion / MOTION_SATURATION, 1)
+
+    score = (
+        SHARPNESS_WEIGHT * sharpness
+        + EXPOSURE_WEIGHT * exposure
+        - MOTION_WEIGHT * motion
+    )
+    if faces is not None:
+        score += FACE_WEIGHT * np.array([len(frame_faces) > 0 for frame_faces in faces])
+
+    return score
+
+
+def best_frame_index(thumbnails: np.ndarray, faces: List[list] = None) -> int:
+    """Deterministically picks the best frame, the first one on ties."""
+    return int(np.argmax(score_frames(thumbnails, faces)))
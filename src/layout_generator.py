@@ -1,6 +1,16 @@
+import base64
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from itertools import count
+from pathlib import Path
+from typing import Iterator, List, Optional
+
 import drawSvg as draw
 
-from structures import Rect, Segment
+from result_cache import write_atomically
+from structures import IMAGE_FORMATS, Rect, Segment
 from text_box import create_text_bubble
 
 COMIC_WIDTH = 450
@@ -9,6 +19,7 @@ COMIC_SPACING_TOLERANCE = 0.2
 COMIC_AREA_MIN = 100 * 100
 COMIC_PADDING = 8
 COMIC_BORDER_WIDTH = 2
+PANEL_ASSET_PREFIX = "panel-"
 
 
 class UnfilledRegion:
@@ -73,88 +84,311 @@ class UnfilledRegion:
 
 
 class LayoutGenerator:
-    def __init__(self):
+    def __init__(
+        self,
+        dpi_scale: float = 2.0,
+        image_format: str = "png",
+        image_quality=None,
+        asset_directory: str = None,
+        asset_url: str = "",
+        rows_per_page: int = None,
+        page_height: float = None,
+    ):
+        """Panels are inlined, unless written to `asset_directory` and linked."""
         self.frames = []
+        self.dpi_scale = dpi_scale
+        self.image_format = image_format
+        self.image_quality = image_quality
+        self.asset_directory = asset_directory
+        self.asset_url = asset_url
+        self.rows_per_page = rows_per_page
+        self.page_height = page_height
+        self.image_bytes = 0
+        # Frames whose images were released, as they are encoded again on rendering.
+        self.__released = set()
+
+    @property
+    def page_rows(self) -> Optional[int]:
+        """The number of rows on each page, or None if the comic is one page."""
+        limits = []
+        if self.rows_per_page:
+            limits.append(self.rows_per_page)
+        if self.page_height:
+            rows_height = self.page_height - 2 * (COMIC_BORDER_WIDTH + COMIC_PADDING)
+            limits.append(int(rows_height // COMIC_MAX_SEGMENT_HEIGHT))
+
+        return max(min(limits), 1) if limits else None
+
+    @property
+    def width(self) -> float:
+        return COMIC_WIDTH + 2 * COMIC_BORDER_WIDTH
+
+    @property
+    def margin(self) -> float:
+        """The space between the edges of the comic and the frames' rects."""
+        return COMIC_BORDER_WIDTH + COMIC_PADDING
 
     def add_frame(self, frame: Segment):
         self.frames.append(frame)
 
-    def render_frames_to_image(self, file_name: str):
-        frame_rects = self.__get_frame_rects_for_rendering(
+    def render_frames_to_image(self, file_name: str, page: int = None):
+        with open(file_name, "w", encoding="utf-8") as file:
+            for chunk in self.iter_svg(page):
+                file.write(chunk)
+
+    def pages(self) -> List[range]:
+        """The indices of the frames on each page."""
+        frame_rects, rows = self.__get_frame_rects_for_rendering(
             COMIC_WIDTH, COMIC_MAX_SEGMENT_HEIGHT
         )
-        height = (
-            frame_rects[-1].y
-            + COMIC_MAX_SEGMENT_HEIGHT
-            + 2 * (COMIC_BORDER_WIDTH + COMIC_PADDING)
+        return self.__paginate(rows)
+
+    def page_index(self) -> List[dict]:
+        """
+        The number of panels, the time span and the height of each page. All but the
+        last page are final: frames added later are laid out on the last page or after.
+        """
+        frame_rects, rows = self.__get_frame_rects_for_rendering(
+            COMIC_WIDTH, COMIC_MAX_SEGMENT_HEIGHT
         )
+        return [
+            {
+                "panels": len(frames),
+                "start": self.frames[frames[0]].start,
+                "end": self.frames[frames[-1]].end,
+                "height": self.__page_height(
+                    frame_rects[frames[-1]].y - frame_rects[frames[0]].y
+                ),
+            }
+            for frames in self.__paginate(rows)
+        ]
 
+    def iter_svg(self, page: int = None) -> Iterator[str]:
+        """
+        Renders the comic, or one of its pages, as pieces of SVG, to be written to a
+        file or a response as they are produced: the header, the elements of each
+        panel, and the footer. The layout is computed up front, and the panel images
+        are only encoded, a few at a time, once their elements are reached.
+        """
+        frame_rects, rows = self.__get_frame_rects_for_rendering(
+            COMIC_WIDTH, COMIC_MAX_SEGMENT_HEIGHT
+        )
+        frames = self.frames
+        if page is not None:
+            indices = self.__paginate(rows)[page]
+            frames = frames[indices.start : indices.stop]
+            # Pages are laid out from the top of their first row.
+            offset = frame_rects[indices.start].y
+            frame_rects = [
+                Rect(rect.x, rect.y - offset, rect.width, rect.height)
+                for rect in frame_rects[indices.start : indices.stop]
+            ]
+        height = self.__page_height(frame_rects[-1].y)
+
+        # The header of an empty drawing of the same size.
         ctx = draw.Drawing(
-            COMIC_WIDTH + 2 * COMIC_BORDER_WIDTH,
+            self.width,
             height,
             origin=(0, 0),
             displayInline=False,
         )
-        ctx.append(
-            draw.Rectangle(
-                COMIC_BORDER_WIDTH,
-                COMIC_BORDER_WIDTH,
-                COMIC_WIDTH,
-                height,
-                fill="#fff",
-            )
+        ctx.setPixelScale(1)
+        yield ctx.asSvg()[: -len("</svg>")]
+
+        yield self.__write_elements(
+            [
+                draw.Rectangle(
+                    COMIC_BORDER_WIDTH,
+                    COMIC_BORDER_WIDTH,
+                    COMIC_WIDTH,
+                    height,
+                    fill="#fff",
+                )
+            ]
         )
-        for rect, frame in zip(frame_rects, self.frames):
+
+        normalized_frame_rects = []
+        for rect, frame in zip(frame_rects, frames):
             assert isinstance(rect, Rect)
             assert isinstance(frame, Segment)
 
-            normalized_frame_rect = Rect(
-                rect.x + COMIC_BORDER_WIDTH + COMIC_PADDING,
-                height
-                - COMIC_BORDER_WIDTH
-                - COMIC_PADDING
-                - rect.y
-                - rect.height,  # Top left coordinate system
-                rect.width - 2 * COMIC_PADDING,
-                rect.height - 2 * COMIC_PADDING,
-            )
+            normalized_frame_rects.append(self.__normalize_rect(rect, height))
 
-            # Draw the frame
-            ctx.append(
-                draw.Image(
-                    normalized_frame_rect.x,
-                    normalized_frame_rect.y,
-                    normalized_frame_rect.width,
-                    normalized_frame_rect.height,
-                    path=f"data:image/png;base64,{frame.image.b64png.decode('ascii')}",
-                )
+        if page is None:
+            # Otherwise, the pages add up to the comic's total.
+            self.image_bytes = 0
+        # OpenCV releases the GIL, so a batch of panels is encoded in parallel.
+        batch_size = os.cpu_count() or 1
+        with ThreadPoolExecutor(batch_size) as executor:
+            for start in range(0, len(frames), batch_size):
+                batch = frames[start : start + batch_size]
+                rects = normalized_frame_rects[start : start + batch_size]
+                images = executor.map(self.__encode_frame_image, batch, rects)
+
+                for normalized_frame_rect, frame, image in zip(rects, batch, images):
+                    self.image_bytes += len(image)
+                    yield self.__write_elements(
+                        self.__frame_elements(
+                            frame, normalized_frame_rect, self.__link_image(image)
+                        )
+                    )
+
+        yield "</svg>"
+
+    def iter_panels(self, start: int = 0) -> Iterator[dict]:
+        """
+        The panels of the frames from `start` on, with their rects, images, speech
+        bubbles and SVGs, positioned from the top left of the comic.
+        """
+        frame_rects, rows = self.__get_frame_rects_for_rendering(
+            COMIC_WIDTH, COMIC_MAX_SEGMENT_HEIGHT
+        )
+        for index in range(start, len(self.frames)):
+            frame = self.frames[index]
+            # Relative to a comic of no height, the drawing's y axis points down.
+            normalized_frame_rect = self.__normalize_rect(frame_rects[index], 0)
+            image = self.__link_image(
+                self.__encode_frame_image(frame, normalized_frame_rect)
             )
 
-            ctx.append(
-                draw.Rectangle(
+            yield {
+                "index": index,
+                "row": rows[index],
+                "rect": [
                     normalized_frame_rect.x,
-                    normalized_frame_rect.y,
+                    -normalized_frame_rect.y - normalized_frame_rect.height,
                     normalized_frame_rect.width,
                     normalized_frame_rect.height,
-                    stroke="#000",
-                    stroke_width=2 * COMIC_BORDER_WIDTH,
-                    fill="rgba(0, 0, 0, 0)",
-                )
+                ],
+                "image": image,
+                "bubble": (
+                    {"transcript": frame.transcript, "speaker": frame.speaker}
+                    if frame.transcript
+                    else None
+                ),
+                "svg": self.__write_elements(
+                    self.__frame_elements(frame, normalized_frame_rect, image)
+                ),
+            }
+
+    @staticmethod
+    def __normalize_rect(rect: Rect, height: float) -> Rect:
+        """The drawing's rect inside the frame's padding, in a comic of `height`."""
+        return Rect(
+            rect.x + COMIC_BORDER_WIDTH + COMIC_PADDING,
+            height
+            - COMIC_BORDER_WIDTH
+            - COMIC_PADDING
+            - rect.y
+            - rect.height,  # Top left coordinate system
+            rect.width - 2 * COMIC_PADDING,
+            rect.height - 2 * COMIC_PADDING,
+        )
+
+    @staticmethod
+    def __page_height(last_frame_y: float) -> float:
+        return (
+            last_frame_y
+            + COMIC_MAX_SEGMENT_HEIGHT
+            + 2 * (COMIC_BORDER_WIDTH + COMIC_PADDING)
+        )
+
+    def __paginate(self, rows: List[int]) -> List[range]:
+        page_rows = self.page_rows
+        if page_rows is None:
+            return [range(len(rows))]
+
+        pages = []
+        start = 0
+        for index in range(1, len(rows) + 1):
+            if (
+                index == len(rows)
+                or rows[index] // page_rows != rows[start] // page_rows
+            ):
+                pages.append(range(start, index))
+                start = index
+
+        return pages
+
+    def __frame_elements(
+        self, frame: Segment, normalized_frame_rect: Rect, image_url: str
+    ) -> list:
+        # Draw the frame
+        elements = [
+            draw.Image(
+                normalized_frame_rect.x,
+                normalized_frame_rect.y,
+                normalized_frame_rect.width,
+                normalized_frame_rect.height,
+                path=image_url,
+            ),
+            draw.Rectangle(
+                normalized_frame_rect.x,
+                normalized_frame_rect.y,
+                normalized_frame_rect.width,
+                normalized_frame_rect.height,
+                stroke="#000",
+                stroke_width=2 * COMIC_BORDER_WIDTH,
+                fill="rgba(0, 0, 0, 0)",
+            ),
+        ]
+
+        if frame.transcript:
+            create_text_bubble(elements, frame, normalized_frame_rect)
+
+        return elements
+
+    @staticmethod
+    def __write_elements(elements: list) -> str:
+        """The SVG of drawing elements that do not define or link to others."""
+        ids = count()
+        output = StringIO()
+        for element in elements:
+            element.writeSvgElement(
+                lambda base="": f"d{base}{next(ids)}", lambda _: False, output, False
             )
+            output.write("\n")
 
-            if frame.transcript:
-                create_text_bubble(ctx, frame, normalized_frame_rect)
+        return output.getvalue()
 
-        ctx.setPixelScale(1)
-        ctx.saveSvg(file_name)
+    def __encode_frame_image(self, frame: Segment, normalized_frame_rect: Rect):
+        size = (
+            round(normalized_frame_rect.width * self.dpi_scale),
+            round(normalized_frame_rect.height * self.dpi_scale),
+        )
+        image = frame.image.encode(size, self.image_format, self.image_quality)
+        # The pixels are no longer needed, rendering again reuses the encoding.
+        if id(frame) not in self.__released:
+            self.__released.add(id(frame))
+            frame.image.release()
+        return image
+
+    def __link_image(self, image: bytes) -> str:
+        extension, mimetype, _ = IMAGE_FORMATS[self.image_format]
+        if self.asset_directory is None:
+            return f"data:{mimetype};base64,{base64.standard_b64encode(image).decode()}"
+
+        name = (
+            f"{PANEL_ASSET_PREFIX}{hashlib.sha256(image).hexdigest()[:32]}{extension}"
+        )
+        path = Path(self.asset_directory) / name
+        if not path.exists():
+            # Other comics may be reading the shared panel.
+            write_atomically(path, image)
+
+        return self.asset_url + name
 
     def __get_frame_rects_for_rendering(self, page_width: int, max_height: int):
+        """The rect of each frame, and the index of the row it is laid out in."""
         frame_rects = []
+        rows = []
+        row = 0
         unfilled = UnfilledRegion(Rect(0, 0, page_width, max_height))
         for frame in self.frames:
             assert isinstance(frame, Segment)
+            aspect = frame.image.rect.aspect
 
-            frame_rect = unfilled.claim_chunk(frame.image.rect.aspect)
+            frame_rect = unfilled.claim_chunk(aspect)
             if not frame_rect:
                 # Failed to claim the chunk: the frame is too large to display in this layout block
                 unfilled = UnfilledRegion(
@@ -162,9 +396,11 @@ class LayoutGenerator:
                         0, unfilled.get_last_unfilled_position(), page_width, max_height
                     )
                 )
-                frame_rect = unfilled.claim_chunk(frame.image.rect.aspect)
+                row += 1
+                frame_rect = unfilled.claim_chunk(aspect)
                 assert frame_rect is not None
 
             frame_rects.append(frame_rect)
+            rows.append(row)
 
-        return frame_rects
+        return frame_rects, rows
@@ -1,15 +1,14 @@
-import os
-import pickle
-import asyncio
 import json
+import os
 import tempfile
+import time
 from pathlib import Path
-from random import randint
-from typing import Callable, List
 
 from flask import (
     Flask,
+    Response,
     abort,
+    jsonify,
     redirect,
     render_template,
     request,
@@ -17,166 +16,25 @@ from flask import (
     url_for,
 )
 
-from face_detector import FaceDetector
-from frame_processor import StyleTransfer
+from comic_pipeline import COMIC_PREFIX, PRODUCTION, UPLOAD_FOLDER, process_video
+from frame_processor import QUALITY_TIERS
+from job_queue import DONE, FAILED, JobQueue
+from layout_generator import PANEL_ASSET_PREFIX
 
-from layout_generator import LayoutGenerator
-from structures import ImageData, Segment
-from transcription import split_utterances, transcribe
-from video_processor import Video
-
-PRODUCTION = os.environ.get("ENV") == "production"
+PANEL_ASSET_MAX_AGE = 365 * 24 * 3600
+# How often job events are checked for, while streaming them.
+EVENT_POLL_INTERVAL = 0.25
+# Event streams end after this many seconds, to free the server's thread, and the
+# client reconnects from its last event.
+EVENT_STREAM_DURATION = float(os.environ.get("EVENT_STREAM_DURATION", 30))
+EVENT_STREAM_RETRY = 500  # Milliseconds before the client reconnects.
 
 app = Flask(__name__)
-app.config["UPLOAD_FOLDER"] = (Path(".") / "uploads").resolve()
+app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1000 * 1000  # Limit uploads to 16 MB.
 app.config["PREFERRED_URL_SCHEME"] = "https"
 
 
-def pipe(
-    *functions: Callable[[Segment], None]
-) -> Callable[[List[Segment]], List[Segment]]:
-    """Implements function composition."""
-
-    def pipeline(segments):
-        for segment in segments:
-            for function in functions:
-                function(segment)
-
-        return segments
-
-    return pipeline
-
-
-def attach_frames(video: Video):
-    def attach_to_segment(segment: Segment) -> None:
-        segment.frames = video.get_frames(segment.start, segment.end)
-
-    return attach_to_segment
-
-
-def get_key_frame_index(segment: Segment) -> None:
-    segment.keyframe_index = randint(0, segment.frames.shape[0] - 1)
-
-
-def detect_speaker(face_detector: FaceDetector):
-    def face_detector_func(segment: Segment) -> None:
-        segment.keyframe = segment.frames[segment.keyframe_index]
-        (
-            segment.speaker_location,
-            segment.speakers_bbox,
-        ) = face_detector.find_speaker_face(segment.keyframe)
-
-    return face_detector_func
-
-
-def crop_keyframe(segment: Segment) -> None:
-    subject_bbox_center = segment.speakers_bbox.center
-
-    PADDING = segment.keyframe.shape[0] * 0.2
-
-    if subject_bbox_center[0] > segment.keyframe.shape[1] * 5 / 6:
-        segment.keyframe = segment.keyframe[
-            :,
-            : int(
-                min(
-                    segment.speakers_bbox.x + segment.speakers_bbox.width + PADDING,
-                    segment.keyframe.shape[1],
-                )
-            ),
-            :,
-        ]
-        segment.speakers_bbox.x -= segment.keyframe.shape[1] - min(
-            segment.speakers_bbox.x + segment.speakers_bbox.width + PADDING,
-            segment.keyframe.shape[1],
-        )
-    elif subject_bbox_center[0] < segment.keyframe.shape[1] * 1 / 6:
-        segment.keyframe = segment.keyframe[
-            :, int(max(segment.speakers_bbox.x - PADDING, 0)) :, :
-        ]
-        segment.speakers_bbox.x -= int(max(segment.speakers_bbox.x - PADDING, 0))
-    else:
-        if randint(0, 1):
-            segment.keyframe = segment.keyframe[
-                :,
-                : int(
-                    min(
-                        segment.speakers_bbox.x + segment.speakers_bbox.width + PADDING,
-                        segment.keyframe.shape[1],
-                    )
-                ),
-                :,
-            ]
-            segment.speakers_bbox.x -= segment.keyframe.shape[1] - min(
-                segment.speakers_bbox.x + segment.speakers_bbox.width + PADDING,
-                segment.keyframe.shape[1],
-            )
-        else:
-            segment.keyframe = segment.keyframe[
-                :, int(max(segment.speakers_bbox.x - PADDING, 0)) :, :
-            ]
-            segment.speakers_bbox.x -= int(max(segment.speakers_bbox.x - PADDING, 0))
-
-    if randint(0, 1):
-        segment.keyframe = segment.keyframe[
-            : int(segment.keyframe.shape[1] * 3 / 4), :, :
-        ]
-        segment.speakers_bbox.y -= segment.keyframe.shape[1] - int(
-            segment.keyframe.shape[1] * 3 / 4
-        )
-
-
-def transfer_keyframe_style(segment: Segment) -> None:
-    transfer_style = StyleTransfer()
-    segment.keyframe = transfer_style(segment.keyframe)
-
-
-def convert_keyframe_to_obj(segment: Segment) -> None:
-    segment.image = ImageData(
-        image_data_matrix=segment.keyframe, image_subject=segment.speakers_bbox
-    )
-
-
-def process_video(path: str) -> str:
-    video = Video(path, fps=2)
-    utterances = split_utterances(asyncio.run(transcribe(video.audio)))
-
-    if not PRODUCTION:
-        with open("transcript.json", "w") as file:
-            json.dump(utterances, file, indent=4)
-
-    face_detector = FaceDetector()
-    pipeline = pipe(
-        attach_frames(video),
-        get_key_frame_index,
-        detect_speaker(face_detector),
-        crop_keyframe,
-        transfer_keyframe_style,
-        convert_keyframe_to_obj,
-    )
-    segments = pipeline(
-        [Segment(**utterance_segment) for utterance_segment in utterances]
-    )
-
-    if not PRODUCTION:
-        for segment in segments:
-            segment.keyframe = None
-            segment.frames = None
-
-        pickle.dump(segments, open("cache.pickle", "wb+"))
-
-    layout = LayoutGenerator()
-    for segment in segments:
-        layout.add_frame(segment)
-
-    _, path = tempfile.mkstemp(
-        prefix="out", suffix=".svg", dir=app.config["UPLOAD_FOLDER"]
-    )
-    layout.render_frames_to_image(path)
-
-    return Path(path).name
-
-
 @app.route("/", methods=["GET"])
 def serve_home():
     return render_template("index.html")
@@ -184,7 +42,21 @@ def serve_home():
 
 @app.route("/uploads/<name>")
 def serve_uploads(name):
-    return send_from_directory(app.config["UPLOAD_FOLDER"], name)
+    if name.startswith(COMIC_PREFIX):
+        return send_from_directory(app.config["UPLOAD_FOLDER"], name)
+    if not name.startswith(PANEL_ASSET_PREFIX):
+        return abort(404)
+
+    # Panels are named by their content hash, so they never change.
+    response = send_from_directory(
+        app.config["UPLOAD_FOLDER"],
+        name,
+        max_age=PANEL_ASSET_MAX_AGE,
+        etag=Path(name).stem[len(PANEL_ASSET_PREFIX) :],
+    )
+    cache_control = f"public, max-age={PANEL_ASSET_MAX_AGE}, immutable"
+    response.headers["Cache-Control"] = cache_control
+    return response
 
 
 app.add_url_rule("/uploads/<name>", endpoint="uploads", build_only=True)
@@ -196,27 +68,124 @@ def chrome_connection_hack(resp):
     return resp
 
 
+# Kept out of the upload folder, as it holds the inputs' paths and the jobs' events.
+Path(app.instance_path).mkdir(parents=True, exist_ok=True)
+# When run as a script, the pipeline's workers import it as __mp_main__, and must
+# not take jobs.
+if __name__ != "__mp_main__":
+    job_queue = JobQueue(
+        os.environ.get("JOB_DATABASE", Path(app.instance_path) / "jobs.sqlite3"),
+        process_video,
+        workers=int(os.environ.get("JOB_WORKERS", 2)),
+    )
+
+
+def redirect_to_comic(comic_name: str):
+    if PRODUCTION:
+        return redirect(
+            url_for("uploads", name=comic_name, _external=True, _scheme="https")
+        )
+
+    return redirect(url_for("uploads", name=comic_name))
+
+
 @app.route("/api/submit", methods=["POST"])
 def submit_video_api():
     if "file" not in request.files:
         return abort(400)
 
+    quality = request.form.get("quality", "full")
+    if quality not in QUALITY_TIERS:
+        return abort(400)
+
     _, path = tempfile.mkstemp(prefix="in", dir=app.config["UPLOAD_FOLDER"])
 
     try:
         data = request.files["file"]
         data.save(path)
 
-        comic_name = process_video(path)
-    finally:
+        job_id = job_queue.submit(path, quality=quality)
+    except Exception:
         Path(path).unlink()
+        raise
+
+    return (
+        jsonify(
+            id=job_id,
+            status=url_for("job_status_api", job_id=job_id),
+            events=url_for("job_events_api", job_id=job_id),
+        ),
+        202,
+    )
 
-    if PRODUCTION:
-        return redirect(
-            url_for("uploads", name=comic_name, _external=True, _scheme="https")
-        )
 
-    return redirect(url_for("uploads", name=comic_name))
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status_api(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return abort(404)
+
+    # Running jobs may already have a partial result, the index of a paginated comic.
+    if job["result"] is not None:
+        job["result"] = url_for("job_result_api", job_id=job_id)
+
+    return jsonify(job)
+
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def job_events_api(job_id):
+    """
+    Streams the job's events as server-sent events, until it is done or failed:
+    "stage" when a stage of the pipeline starts, "layout" with the comic's width,
+    "panel" with each panel once it is styled, and finally "done" with the result,
+    or "failed". Long streams are ended early and resumed from Last-Event-ID.
+    """
+    if job_queue.get(job_id) is None:
+        return abort(404)
+
+    result = url_for("job_result_api", job_id=job_id)
+    # Malformed IDs restart the stream from the beginning.
+    after = request.headers.get("Last-Event-ID", 0, type=int)
+    deadline = time.monotonic() + EVENT_STREAM_DURATION
+
+    def stream():
+        nonlocal after
+        yield f"retry: {EVENT_STREAM_RETRY}\n\n"
+        while time.monotonic() < deadline:
+            # Read before the events, so that none logged before it finished are missed.
+            job = job_queue.get(job_id)
+            if job is None:
+                return
+            for after, event in job_queue.events(job_id, after):
+                yield f"id: {after}\nevent: {event.pop('type')}\n"
+                yield f"data: {json.dumps(event)}\n\n"
+
+            if job["status"] == DONE:
+                data = json.dumps({"result": result, "stats": job["stats"]})
+                yield f"event: done\ndata: {data}\n\n"
+                return
+            if job["status"] == FAILED:
+                yield f"event: failed\ndata: {json.dumps(job['error'])}\n\n"
+                return
+
+            time.sleep(EVENT_POLL_INTERVAL)
+
+    return Response(
+        stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+
+@app.route("/api/jobs/<job_id>/result", methods=["GET"])
+def job_result_api(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return abort(404)
+    if job["status"] == FAILED:
+        return abort(500)
+    if job["result"] is None:
+        return abort(409)
+
+    return redirect_to_comic(job["result"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+import copy
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import suppress
+from multiprocessing import get_all_start_methods, get_context, shared_memory
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from structures import Segment
+
+StagesFactory = Callable[..., List[Callable[[Segment], None]]]
+
+# Pipeline stages of the worker process, created once per set of options.
+_stages_factory: StagesFactory = None
+_stages: Dict[tuple, List[Callable[[Segment], None]]] = {}
+
+
+def _init_worker(stages_factory: StagesFactory):
+    global _stages_factory
+    _stages_factory = stages_factory
+    _get_stages({})
+
+
+def _get_stages(options: dict) -> List[Callable[[Segment], None]]:
+    key = tuple(sorted(options.items()))
+    if key not in _stages:
+        _stages[key] = _stages_factory(**options)
+    return _stages[key]
+
+
+def _run_segment(
+    segment: Segment, block_name: str, shape: tuple, dtype: str, options: dict
+) -> Tuple[Segment, Optional[tuple]]:
+    """
+    Runs the stages on a segment whose keyframe is in the shared memory block.
+    The resulting keyframe is written back into the block if it fits.
+    """
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        segment.keyframe = np.ndarray(shape, dtype, buffer=block.buf)
+        for stage in _get_stages(options):
+            stage(segment)
+
+        keyframe, keyframe_spec = segment.keyframe, None
+        if keyframe is not None and keyframe.nbytes <= block.size:
+            out = np.ndarray(keyframe.shape, keyframe.dtype, buffer=block.buf)
+            out[...] = keyframe
+            keyframe_spec = (keyframe.shape, keyframe.dtype.str)
+            segment.keyframe = None
+            del out
+        elif keyframe is not None:
+            segment.keyframe = np.array(keyframe)
+
+        # The image data is the keyframe, restored by the parent.
+        if segment.image is not None and segment.image.data is keyframe:
+            segment.image.data = segment.keyframe
+        del keyframe
+
+        return segment, keyframe_spec
+    finally:
+        # Fails if views of the block are still referenced after an error.
+        with suppress(BufferError):
+            block.close()
+
+
+class ParallelPipeline:
+    """
+    Runs the per-segment stages on a process pool, preserving the segment order.
+    The pool is started on first use, and rebuilt if a worker dies. Keyframes are
+    shipped through shared memory instead of being pickled.
+    """
+
+    def __init__(
+        self,
+        stages_factory: StagesFactory,
+        workers: int = None,
+    ) -> None:
+        self.stages_factory = stages_factory
+        self.workers = workers
+        if "forkserver" in get_all_start_methods():
+            self.context = get_context("forkserver")
+            # The stages' module is imported once, rather than by every worker.
+            self.context.set_forkserver_preload([stages_factory.__module__])
+        else:
+            self.context = get_context("spawn")
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=self.context,
+                    initializer=_init_worker,
+                    initargs=(self.stages_factory,),
+                )
+            return self.executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor) -> None:
+        """Replaces the broken `executor` on the next run, unless already done."""
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False)
+
+    def __call__(self, segments: List[Segment], **options) -> List[Segment]:
+        executor = self._get_executor()
+        try:
+            return self._run(executor, segments, options)
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            raise
+
+    def _run(
+        self, executor: ProcessPoolExecutor, segments: List[Segment], options: dict
+    ) -> List[Segment]:
+        blocks = []
+        try:
+            futures = []
+            for segment in segments:
+                block = shared_memory.SharedMemory(
+                    create=True, size=max(segment.keyframe.nbytes, 1)
+                )
+                blocks.append(block)
+                np.ndarray(
+                    segment.keyframe.shape, segment.keyframe.dtype, buffer=block.buf
+                )[...] = segment.keyframe
+
+                shipped = copy.copy(segment)
+                shipped.keyframe = None
+                futures.append(
+                    executor.submit(
+                        _run_segment,
+                        shipped,
+                        block.name,
+                        segment.keyframe.shape,
+                        segment.keyframe.dtype.str,
+                        options,
+                    )
+                )
+
+            results = []
+            for block, future in zip(blocks, futures):
+                segment, keyframe_spec = future.result()
+                if keyframe_spec is not None:
+                    segment.keyframe = np.ndarray(
+                        *keyframe_spec, buffer=block.buf
+                    ).copy()
+                    if segment.image is not None and segment.image.data is None:
+                        # The image data was the keyframe.
+                        segment.image.data = segment.keyframe
+                results.append(segment)
+
+            return results
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    def shutdown(self) -> None:
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
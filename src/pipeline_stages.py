@@ -0,0 +1,135 @@
+import os
+from random import randint
+from typing import Callable, List, Tuple
+
+from face_detector import FaceDetector
+from frame_processor import QUALITY_TIERS, StyleTransfer
+from structures import ImageData, Segment
+
+FACE_DETECTOR_BACKEND = os.environ.get("FACE_DETECTOR_BACKEND", "hog")
+FACE_DETECTION_SIZE = int(os.environ.get("FACE_DETECTION_SIZE", 640))
+
+
+def create_face_detector() -> FaceDetector:
+    return FaceDetector(FACE_DETECTOR_BACKEND, detection_size=FACE_DETECTION_SIZE)
+
+
+def detect_speaker(face_detector: FaceDetector):
+    def face_detector_func(segment: Segment) -> None:
+        # Already found in the speculative pass, or shared within the shot.
+        if segment.speakers_bbox is not None:
+            return
+
+        speakers = face_detector.find_speaker_face(segment.keyframe)
+        segment.speaker_location, segment.speakers_bbox = speakers
+
+    return face_detector_func
+
+
+def choose_crop(segment: Segment, width: int) -> Tuple[bool, bool]:
+    """
+    Whether to crop the right, rather than the left, side, and the bottom of the
+    segment's keyframe, `width` pixels wide.
+    """
+    subject_bbox_center = segment.speakers_bbox.center
+
+    if subject_bbox_center[0] > width * 5 / 6:
+        crop_right = True
+    elif subject_bbox_center[0] < width * 1 / 6:
+        crop_right = False
+    else:
+        crop_right = bool(randint(0, 1))
+
+    return crop_right, bool(randint(0, 1))
+
+
+def crop_keyframe(segment: Segment) -> None:
+    if segment.keyframe_cropped:
+        return
+    if segment.crop is None:
+        segment.crop = choose_crop(segment, segment.keyframe.shape[1])
+    crop_right, crop_bottom = segment.crop
+
+    PADDING = segment.keyframe.shape[0] * 0.2
+
+    if crop_right:
+        segment.keyframe = segment.keyframe[
+            :,
+            : int(
+                min(
+                    segment.speakers_bbox.x + segment.speakers_bbox.width + PADDING,
+                    segment.keyframe.shape[1],
+                )
+            ),
+            :,
+        ]
+        segment.speakers_bbox.x -= segment.keyframe.shape[1] - min(
+            segment.speakers_bbox.x + segment.speakers_bbox.width + PADDING,
+            segment.keyframe.shape[1],
+        )
+    else:
+        segment.keyframe = segment.keyframe[
+            :, int(max(segment.speakers_bbox.x - PADDING, 0)) :, :
+        ]
+        segment.speakers_bbox.x -= int(max(segment.speakers_bbox.x - PADDING, 0))
+
+    if crop_bottom:
+        segment.keyframe = segment.keyframe[
+            : int(segment.keyframe.shape[1] * 3 / 4), :, :
+        ]
+        segment.speakers_bbox.y -= segment.keyframe.shape[1] - int(
+            segment.keyframe.shape[1] * 3 / 4
+        )
+
+    segment.keyframe_cropped = True
+
+
+style_transfers = {quality: StyleTransfer(quality=quality) for quality in QUALITY_TIERS}
+
+
+def transfer_keyframe_style(style_transfer: StyleTransfer):
+    def style_transfer_func(segment: Segment) -> None:
+        if segment.keyframe_styled:
+            return
+
+        segment.keyframe = style_transfer(segment.keyframe)
+        segment.keyframe_styled = True
+
+    return style_transfer_func
+
+
+def transfer_keyframes_style(
+    segments: List[Segment], style_transfer: StyleTransfer
+) -> List[Segment]:
+    """Batched `transfer_keyframe_style`."""
+    unstyled = [segment for segment in segments if not segment.keyframe_styled]
+    keyframes = style_transfer.batch([segment.keyframe for segment in unstyled])
+    for segment, keyframe in zip(unstyled, keyframes):
+        segment.keyframe = keyframe
+        segment.keyframe_styled = True
+
+    return segments
+
+
+def convert_keyframe_to_obj(segment: Segment) -> None:
+    segment.image = ImageData(
+        image_data_matrix=segment.keyframe, image_subject=segment.speakers_bbox
+    )
+
+
+def segment_stages(
+    quality: str = "full", detect_only: bool = False
+) -> List[Callable[[Segment], None]]:
+    """
+    The CPU-bound per-segment stages, run after the keyframe is attached. They are
+    kept out of main, as the pipeline's worker processes import them.
+    """
+    if detect_only:
+        return [detect_speaker(create_face_detector())]
+
+    return [
+        detect_speaker(create_face_detector()),
+        crop_keyframe,
+        transfer_keyframe_style(style_transfers[quality]),
+        convert_keyframe_to_obj,
+    ]
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import suppress
+from pathlib import Path
+from typing import Optional
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of the file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def write_atomically(path: Path, data: bytes) -> None:
+    """
+    Writes to a hidden temporary file next to `path` first, then replaces it, so
+    that readers never see partial contents.
+    """
+    path = Path(path)
+    fd, temporary_path = tempfile.mkstemp(prefix=".", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(temporary_path)
+        raise
+
+
+class ResultCache:
+    """
+    Content-addressed cache of the pipeline's outputs, as files in `directory`.
+    Entries are keyed by the digest of the input, the stage and its configuration.
+    Once the cache grows over `max_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(digest: str, stage: str, config: dict) -> str:
+        config = json.dumps(config, sort_keys=True)
+        return hashlib.sha256(f"{digest}:{stage}:{config}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.directory / key
+        try:
+            data = path.read_bytes()
+            # The modification time orders the entries by last use.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        write_atomically(self.directory / key, data)
+
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for path in self.directory.iterdir():
+            with suppress(FileNotFoundError):
+                entries.append((path.stat(), path))
+
+        size = sum(stat.st_size for stat, _ in entries)
+        for stat, path in sorted(entries, key=lambda entry: entry[0].st_mtime):
+            if size <= self.max_bytes:
+                break
+
+            if not path.name.startswith("."):
+                path.unlink(missing_ok=True)
+                size -= stat.st_size
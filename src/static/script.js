@@ -1,16 +1,130 @@
 'use strict';
 
-async function upload(file) {
+const POLL_INTERVAL_MS = 1000;
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+async function showPages(index_url) {
+    // Adds the pages of a paginated comic that are not shown yet.
+    const response = await fetch(index_url, {cache: 'no-store'});
+    const index = await response.json();
+
+    const pages = document.getElementById('pages');
+    for (const page of index.pages.slice(pages.children.length)) {
+        const object = document.createElement('object');
+        object.type = 'image/svg+xml';
+        object.className = 'w-100';
+        object.data = new URL(page.name, response.url);
+        pages.appendChild(object);
+    }
+}
+
+async function waitForJob(status_url) {
+    while (true) {
+        const response = await fetch(status_url);
+        if (!response.ok) {
+            return response;
+        }
+
+        const job = await response.json();
+        if (job.result && job.status === 'running') {
+            // The first pages of a paginated comic are shown while the rest are made.
+            await showPages(job.result);
+        }
+        if (job.status === 'done') {
+            // Only resolves the comic's URL, it is loaded by the page.
+            return fetch(job.result, {method: 'HEAD'});
+        }
+        if (job.status === 'failed') {
+            return new Response(null, {status: 500, statusText: 'Processing failed'});
+        }
+
+        await sleep(POLL_INTERVAL_MS);
+    }
+}
+
+const STAGE_MESSAGES = {
+    transcription: 'Transcribing...',
+    keyframes: 'Picking the frames...',
+    styling: 'Drawing the panels...',
+    rendering: 'Putting the comic together...',
+};
+
+function streamJob(events_url, status_url) {
+    // Draws the panels as they are made, resolving like waitForJob once done.
+    return new Promise(resolve => {
+        const events = new EventSource(events_url);
+        const msg = document.getElementById('msg');
+        const live = document.getElementById('live');
+        let margin = 0;
+        let height = 0;
+
+        events.addEventListener('stage', event => {
+            const stage = JSON.parse(event.data).stage;
+            msg.innerText = STAGE_MESSAGES[stage] || msg.innerText;
+        });
+
+        events.addEventListener('layout', event => {
+            const layout = JSON.parse(event.data);
+            margin = layout.margin;
+            live.setAttribute('viewBox', `0 0 ${layout.width} 0`);
+            live.innerHTML = '';
+        });
+
+        events.addEventListener('panel', event => {
+            const panel = JSON.parse(event.data);
+            const [x, y, width, panel_height] = panel.rect;
+            height = Math.max(height, y + panel_height + margin);
+
+            live.insertAdjacentHTML('beforeend', panel.svg);
+            live.viewBox.baseVal.height = height;
+            live.classList.remove('d-none');
+        });
+
+        events.addEventListener('done', event => {
+            events.close();
+            // Only resolves the comic's URL, it is loaded by the page.
+            resolve(fetch(JSON.parse(event.data).result, {method: 'HEAD'}));
+        });
+
+        events.addEventListener('failed', event => {
+            events.close();
+            resolve(new Response(null, {status: 500, statusText: 'Processing failed'}));
+        });
+
+        events.onerror = () => {
+            // Reconnects by itself, unless the stream could not be opened.
+            if (events.readyState === EventSource.CLOSED) {
+                resolve(waitForJob(status_url));
+            }
+        };
+    });
+}
+
+async function upload(file, quality) {
     const data = new FormData()
     data.append('file', file)
+    data.append('quality', quality)
 
     let status = 'Here you go!';
 
-    const response = await fetch('/api/submit', {
+    let response = await fetch('/api/submit', {
         method: 'POST',
         body: data
     });
 
+    if (response.ok) {
+        const job = await response.json();
+        if (window.EventSource) {
+            response = await streamJob(job.events, job.status);
+        }
+        else {
+            response = await waitForJob(job.status);
+        }
+    }
+
     if (!response.ok) {
         if (response.status === 413) {
             // File too long.
@@ -20,15 +134,19 @@ async function upload(file) {
             status = `Upload failed. Error: ${response.statusText}.`;
         }
     }
+    else if (response.headers.get('Content-Type').startsWith('application/json')) {
+        await showPages(response.url);
+    }
     else {
-        const img_blob = await response.blob();
-        const img_url = URL.createObjectURL(img_blob);
-
-        const img = document.getElementById('image');
-        img.src = img_url;
-        img.classList.remove('d-none');
+        // An object, rather than an img, loads the panels the comic links to.
+        const comic = document.getElementById('image');
+        comic.data = response.url;
+        comic.classList.remove('d-none');
     }
 
+    // Replaced by the rendered comic.
+    document.getElementById('live').remove();
+
     const form = document.getElementById('form');
     form.remove();
 
@@ -39,6 +157,7 @@ async function upload(file) {
 document.addEventListener('DOMContentLoaded', () => {
     const input = document.getElementById('file_input');
     const button = document.getElementById('submit_button');
+    const preview = document.getElementById('preview_input');
 
     input.addEventListener('change', event => {
         button.disabled = (event.target.value === '');
@@ -48,6 +167,6 @@ document.addEventListener('DOMContentLoaded', () => {
         button.disabled = true;
         button.innerHTML = '<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span>';
 
-        upload(input.files[0]);
+        upload(input.files[0], preview.checked ? 'preview' : 'full');
     });
 })
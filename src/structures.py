@@ -1,23 +1,47 @@
 import base64
+import threading
+from typing import List, Tuple
 
 import cv2
 import numpy as np
 
+# Extension, MIME type and quality parameter of the formats panels can be encoded in.
+IMAGE_FORMATS = {
+    "png": (".png", "image/png", None),
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+# Guards the count of segments sharing each image, released from rendering threads.
+_release_lock = threading.Lock()
+
 
 class Rect:
+    __slots__ = ("x", "y", "width", "height")
+
     def __init__(self, x, y, width, height) -> None:
         self.x = x
         self.y = y
         self.width = width
         self.height = height
 
-        if height == 0:
-            self.aspect = 1000  # ≈∞
-        else:
-            self.aspect = width / height
+    # Derived on access, so that they follow changes to the position and size.
+    @property
+    def aspect(self) -> float:
+        if self.height == 0:
+            return 1000  # ≈∞
+        return self.width / self.height
 
-        self.area = width * height
-        self.center = (self.x + self.width // 2, self.y + self.height // 2)
+    @property
+    def area(self):
+        return self.width * self.height
+
+    @property
+    def center(self) -> tuple:
+        return (self.x + self.width // 2, self.y + self.height // 2)
+
+    def copy(self) -> "Rect":
+        return Rect(self.x, self.y, self.width, self.height)
 
     def __repr__(self) -> str:
         x, y, width, height = self.x, self.y, self.width, self.height
@@ -28,27 +52,108 @@ class ImageData:
     def __init__(
         self, image_data_matrix, image_subject: Rect, image_importance=None
     ) -> None:
-        _, buffer = cv2.imencode(".png", image_data_matrix)
-        self.b64png = base64.standard_b64encode(buffer)
-
+        """
+        The image is only encoded when needed, and each encoding is kept, so that the
+        pixels can be released with `release` once all the encodings are made. It can
+        be shared by several segments with `share`.
+        """
         self.data = image_data_matrix
         self.subject = image_subject
         self.rect = Rect(0, 0, image_data_matrix.shape[1], image_data_matrix.shape[0])
         self.priority = image_importance
+        self._encodings = {}
+        self._users = 1
+
+    @property
+    def b64png(self) -> bytes:
+        """The image at full resolution, PNG encoded."""
+        return base64.standard_b64encode(self.encode())
+
+    def encode(
+        self, size: Tuple[int, int] = None, format: str = "png", quality: int = None
+    ) -> bytes:
+        """
+        The image encoded in the named format from `IMAGE_FORMATS`, downscaled to fit
+        within `size`, as (width, height) in pixels, if given.
+        """
+        width, height = self.rect.width, self.rect.height
+        if size is not None:
+            scale = min(size[0] / width, size[1] / height)
+            if scale < 1:
+                width = max(round(width * scale), 1)
+                height = max(round(height * scale), 1)
+
+        key = (width, height, format, quality)
+        if key in self._encodings:
+            return self._encodings[key]
+        if self.data is None:
+            raise ValueError("Image was released before it was encoded like this")
+
+        image = self.data
+        if (width, height) != (self.rect.width, self.rect.height):
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+        extension, _, quality_parameter = IMAGE_FORMATS[format]
+        parameters = []
+        if quality is not None and quality_parameter is not None:
+            parameters = [quality_parameter, quality]
+
+        _, buffer = cv2.imencode(extension, image, parameters)
+        self._encodings[key] = buffer.tobytes()
+        return self._encodings[key]
+
+    def share(self) -> "ImageData":
+        """The image, for one more segment, which must also `release` it."""
+        with _release_lock:
+            self._users += 1
+        return self
+
+    def release(self) -> None:
+        """
+        Frees the pixels once every segment sharing the image released it, only the
+        encodings made so far remain available.
+        """
+        with _release_lock:
+            self._users -= 1
+            if self._users <= 0:
+                self.data = None
 
 
 class Segment:
+    __slots__ = (
+        "start",
+        "end",
+        "transcript",
+        "speaker",
+        "faces",
+        "keyframe_index",
+        "frame_index",
+        "shot",
+        "keyframe",
+        "keyframe_cropped",
+        "keyframe_styled",
+        "speaker_location",
+        "speakers_bbox",
+        "crop",
+        "image",
+    )
+
     def __init__(
         self,
         start: float,
         end: float,
         transcript: str,
         speaker: int,
-        frames: np.ndarray = None,
+        faces: list = None,
         keyframe_index: int = None,
+        frame_index: int = None,
+        shot: int = None,
         keyframe: np.ndarray = None,
+        keyframe_cropped: bool = False,
+        keyframe_styled: bool = False,
         speaker_location: Rect = None,
         speakers_bbox: Rect = None,
+        crop: tuple = None,
         image: ImageData = None,
     ):
         self.start = start
@@ -56,9 +161,40 @@ class Segment:
         self.transcript = transcript
         self.speaker = speaker
 
-        self.frames = frames
+        self.faces = faces  # Face bounding boxes in each of the frames
         self.keyframe_index = keyframe_index
+        self.frame_index = frame_index  # Index of the keyframe in the whole video
+        self.shot = shot
         self.keyframe = keyframe
+        self.keyframe_cropped = keyframe_cropped
+        self.keyframe_styled = keyframe_styled
         self.speaker_location = speaker_location
         self.speakers_bbox = speakers_bbox
+        self.crop = crop
         self.image = image
+
+
+class SegmentTable:
+    """
+    Columns of a list of segments as arrays, for bulk operations over all of them:
+    their start and end times.
+    """
+
+    __slots__ = ("start", "end")
+
+    def __init__(self, start: np.ndarray, end: np.ndarray) -> None:
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def from_segments(cls, segments: List[Segment]) -> "SegmentTable":
+        start = np.fromiter(
+            (segment.start for segment in segments), np.float64, len(segments)
+        )
+        end = np.fromiter(
+            (segment.end for segment in segments), np.float64, len(segments)
+        )
+        return cls(start, end)
+
+    def __len__(self) -> int:
+        return len(self.start)
@@ -58,7 +58,7 @@ def create_text_bubble(ctx, frame: Segment, normalized_frame_rect: Rect):
             10,
             x=text_bb.x,
             y=text_bb.y + text_bb.height,
-            fill=SPEAKER_COLORS[frame.speaker],
+            fill=SPEAKER_COLORS[frame.speaker % len(SPEAKER_COLORS)],
             valign="top",
             font_family="Comic Sans MS",
         )
@@ -1,60 +1,175 @@
-import os
-from contextlib import suppress
+import codecs
+import json
+import re
 from textwrap import wrap
+from typing import List, Tuple, TypedDict, Union
+
+
+class Utterance(TypedDict):
+    start: float
+    end: float
+    transcript: str
+    speaker: int
+
+
+def read_utterance(value: dict) -> Utterance:
+    """Validates a Deepgram utterance, keeping only the fields that are used."""
+    if not isinstance(value, dict):
+        raise ValueError(f"Utterance is not an object: {value!r}")
+
+    for key, types in (
+        ("start", (int, float)),
+        ("end", (int, float)),
+        ("transcript", str),
+        ("speaker", int),
+    ):
+        if not isinstance(value.get(key), types) or isinstance(value[key], bool):
+            raise ValueError(f"Utterance has no valid {key!r}: {value.get(key)!r}")
+
+    return Utterance(
+        start=float(value["start"]),
+        end=float(value["end"]),
+        transcript=value["transcript"],
+        speaker=value["speaker"],
+    )
 
-from deepgram import Deepgram
-from dotenv import load_dotenv
-
-load_dotenv(".secrets")
-
-
-def delete_keys(transcript: dict, keys: list):
-    for key in keys:
-        with suppress(KeyError):
-            del transcript[key]
-
-    for value in transcript.values():
-        if isinstance(value, dict):
-            delete_keys(value, keys)
-
-        if isinstance(value, list):
-            for child in value:
-                if isinstance(child, dict):
-                    delete_keys(child, keys)
-
-
-def validate_transcript(transcript: dict):
-    assert "results" in transcript
-    assert "utterances" in transcript["results"]
-
-    utterances: list = transcript["results"]["utterances"]
-    assert isinstance(utterances, list)
-
-    for utterance in utterances:
-        assert isinstance(utterance, dict)
-
-        assert "start" in utterance
-        assert "end" in utterance
-        assert "transcript" in utterance
-        assert "speaker" in utterance
-
-
-async def transcribe(audio: bytes) -> list:
-    dg_client = Deepgram(os.getenv("DEEPGRAM_API_KEY"))
 
-    source = {"buffer": audio, "mimetype": "audio/wav"}
+class UtteranceParser:
+    """
+    Incrementally extracts the utterances from the chunks of a Deepgram pre-recorded
+    transcription response, as they are received. Everything before
+    `results.utterances`, including the word-level `channels`, is skipped without
+    being parsed, and only one utterance is decoded at a time.
+    """
+
+    KEY = '"utterances":'
+    SEPARATORS = re.compile(r"[\s,]*")
+
+    def __init__(self) -> None:
+        self.utterances: List[Utterance] = []
+        self.buffer = ""
+        self.found = False
+        self.opened = False
+        self.done = False
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def feed(self, chunk: Union[bytes, str]) -> None:
+        if isinstance(chunk, bytes):
+            chunk = self._text_decoder.decode(chunk)
+        if self.done:
+            return
+
+        self.buffer += chunk
+        if not self.found:
+            position = self.buffer.find(self.KEY)
+            if position < 0:
+                # The key may be split across chunks.
+                self.buffer = self.buffer[-len(self.KEY) :]
+                return
+
+            self.buffer = self.buffer[position + len(self.KEY) :]
+            self.found = True
+
+        if not self.opened:
+            self.buffer = self.buffer.lstrip()
+            if not self.buffer:
+                return
+            if not self.buffer.startswith("["):
+                raise ValueError("Transcript utterances are not a list")
+
+            self.buffer = self.buffer[1:]
+            self.opened = True
+
+        self._parse_utterances()
+
+    def _parse_utterances(self) -> None:
+        position = 0
+        while True:
+            position = self.SEPARATORS.match(self.buffer, position).end()
+            if self.buffer.startswith("]", position):
+                self.done = True
+                self.buffer = ""
+                return
+
+            try:
+                value, position = self._decoder.raw_decode(self.buffer, position)
+            except json.JSONDecodeError:
+                # Incomplete, until more of the response is received.
+                self.buffer = self.buffer[position:]
+                return
+
+            self.utterances.append(read_utterance(value))
+
+    def close(self) -> List[Utterance]:
+        if not self.done:
+            raise ValueError("Transcript has no complete results.utterances")
+
+        return self.utterances
+
+
+def parse_utterances(response: Union[bytes, str]) -> List[Utterance]:
+    """The utterances of a complete Deepgram pre-recorded transcription response."""
+    parser = UtteranceParser()
+    parser.feed(response)
+    return parser.close()
+
+
+def stitch_utterances(chunks: List[Tuple[float, float, list]]) -> list:
+    """
+    Joins the utterances of overlapping (start, end, utterances) chunks, matching the
+    speakers in the overlaps, where the earlier chunk's utterances are kept.
+    """
+    out = []
+    speaker_count = 0
+    previous_end = None
 
-    transcript = await dg_client.transcription.prerecorded(
-        source, {"punctuate": True, "diarize": True, "utterances": True}
-    )
+    for start, end, utterances in chunks:
+        utterances = [
+            {
+                **utterance,
+                "start": utterance["start"] + start,
+                "end": utterance["end"] + start,
+            }
+            for utterance in utterances
+        ]
 
-    delete_keys(
-        transcript, ["metadata", "channel", "channels", "words", "id", "confidence"]
-    )
+        # Time spoken simultaneously by pairs of speakers, in the overlap.
+        overlaps = {}
+        for utterance in utterances:
+            for previous in out:
+                if previous["end"] <= start:
+                    continue
+                duration = min(utterance["end"], previous["end"]) - max(
+                    utterance["start"], previous["start"]
+                )
+                if duration > 0:
+                    key = utterance["speaker"], previous["speaker"]
+                    overlaps[key] = overlaps.get(key, 0) + duration
+
+        speakers = {}
+        for (speaker, previous_speaker), _ in sorted(
+            overlaps.items(), key=lambda item: item[1], reverse=True
+        ):
+            if speaker not in speakers and previous_speaker not in speakers.values():
+                speakers[speaker] = previous_speaker
+
+        for utterance in utterances:
+            if (
+                previous_end is not None
+                and (utterance["start"] + utterance["end"]) / 2 < previous_end
+            ):
+                continue
+            if utterance["speaker"] not in speakers:
+                speakers[utterance["speaker"]] = speaker_count
+                speaker_count += 1
+
+            utterance["speaker"] = speakers[utterance["speaker"]]
+            out.append(utterance)
 
-    validate_transcript(transcript)
+        previous_end = end
 
-    return transcript["results"]["utterances"]
+    return out
 
 
 def split_utterances(
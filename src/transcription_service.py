@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from contextlib import suppress
+from pathlib import Path
+from typing import List, Optional
+
+import aiohttp
+
+from result_cache import write_atomically
+from transcription import UtteranceParser
+
+DEEPGRAM_URL = "https://api.deepgram.com/v1/listen"
+RESPONSE_CHUNK_SIZE = 1 << 16
+TRANSCRIPTION_OPTIONS = {"punctuate": True, "diarize": True, "utterances": True}
+
+
+def transcript_key(audio: bytes, mimetype: str, options: dict) -> str:
+    """Identifies a transcript by the digest of the audio and the request options."""
+    digest = hashlib.sha256(audio).hexdigest()
+    options = json.dumps(options, sort_keys=True)
+    return hashlib.sha256(f"{digest}:{mimetype}:{options}".encode()).hexdigest()
+
+
+class DeepgramBackend:
+    """
+    Deepgram's pre-recorded audio API, called over one long-lived session, so that
+    connections are pooled and reused between requests.
+    """
+
+    def __init__(self, api_key: str, connections: int = 8) -> None:
+        self.api_key = api_key
+        self.connections = connections
+        self._session = None
+
+    async def __call__(self, audio: bytes, mimetype: str, options: dict) -> list:
+        if self._session is None:
+            # Created lazily, as it is bound to the event loop it is created in.
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                headers={"Authorization": f"Token {self.api_key}"},
+                raise_for_status=True,
+            )
+
+        params = {key: str(value).lower() for key, value in options.items()}
+        async with self._session.post(
+            DEEPGRAM_URL,
+            params=params,
+            data=audio,
+            headers={"Content-Type": mimetype},
+        ) as response:
+            # Parsed as it is received, as the word-level results are large.
+            parser = UtteranceParser()
+            async for chunk in response.content.iter_chunked(RESPONSE_CHUNK_SIZE):
+                parser.feed(chunk)
+            return parser.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+class ReplayBackend:
+    """
+    Replays transcripts recorded in a directory, such as the transcript cache, to
+    load test the pipeline offline. The transcript recorded for the same audio is
+    used if there is one, and otherwise one chosen by the digest of the audio.
+    """
+
+    def __init__(self, directory: str, latency: float = 0.0) -> None:
+        self.recordings = sorted(Path(directory).glob("*.json"))
+        self.latency = latency
+        if not self.recordings:
+            raise FileNotFoundError(f"No recorded transcripts in {directory}")
+
+    async def __call__(self, audio: bytes, mimetype: str, options: dict) -> list:
+        await asyncio.sleep(self.latency)
+
+        key = transcript_key(audio, mimetype, options)
+        recording = next(
+            (path for path in self.recordings if path.stem == key),
+            self.recordings[int(key, 16) % len(self.recordings)],
+        )
+        return json.loads(recording.read_text())
+
+    async def close(self) -> None:
+        pass
+
+
+class TranscriptCache:
+    """Transcripts stored as JSON files, which expire `ttl` seconds after writing."""
+
+    def __init__(self, directory: str, ttl: float) -> None:
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _expired(self, path: Path) -> bool:
+        return time.time() - path.stat().st_mtime > self.ttl
+
+    def get(self, key: str) -> Optional[list]:
+        path = self.directory / f"{key}.json"
+        try:
+            if self._expired(path):
+                path.unlink(missing_ok=True)
+                return None
+            return json.loads(path.read_text())
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, utterances: list) -> None:
+        write_atomically(
+            self.directory / f"{key}.json", json.dumps(utterances).encode()
+        )
+
+        self.evict()
+
+    def evict(self) -> None:
+        for path in self.directory.glob("*.json"):
+            with suppress(FileNotFoundError):
+                if self._expired(path):
+                    path.unlink(missing_ok=True)
+
+
+class TranscriptionService:
+    """
+    Transcribes audio with the backend, on an event loop owned by the service, so
+    that the backend's connections outlive a single request. Transcripts are cached,
+    and failed or timed out requests are retried a bounded number of times.
+    """
+
+    def __init__(
+        self,
+        backend,
+        cache: TranscriptCache = None,
+        options: dict = TRANSCRIPTION_OPTIONS,
+        timeout: float = 120,
+        retries: int = 2,
+        retry_delay: float = 1.0,
+        concurrency: int = 4,
+    ) -> None:
+        self.backend = backend
+        self.cache = cache
+        self.options = options
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.concurrency = concurrency
+
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+
+        return self._loop
+
+    def transcribe(self, audio: bytes, mimetype: str = "audio/wav") -> list:
+        """Blocking `transcribe_async`, which can be called from any thread."""
+        return asyncio.run_coroutine_threadsafe(
+            self.transcribe_async(audio, mimetype), self.loop
+        ).result()
+
+    def transcribe_all(self, audios: List[bytes], mimetype: str = "audio/wav") -> list:
+        """
+        The utterances in each of the audios, transcribed concurrently, with at most
+        `concurrency` requests in flight.
+        """
+
+        async def transcribe_all_async():
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def transcribe_bounded(audio):
+                async with semaphore:
+                    return await self.transcribe_async(audio, mimetype)
+
+            return await asyncio.gather(*map(transcribe_bounded, audios))
+
+        return asyncio.run_coroutine_threadsafe(
+            transcribe_all_async(), self.loop
+        ).result()
+
+    async def transcribe_async(self, audio: bytes, mimetype: str = "audio/wav") -> list:
+        """The utterances in the audio. Must be awaited on the service's loop."""
+        key = transcript_key(audio, mimetype, self.options)
+        if self.cache is not None:
+            utterances = self.cache.get(key)
+            if utterances is not None:
+                return utterances
+
+        for attempt in range(self.retries + 1):
+            try:
+                utterances = await asyncio.wait_for(
+                    self.backend(audio, mimetype, self.options), self.timeout
+                )
+                break
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                # Client errors, besides rate limiting, would fail again.
+                if (
+                    isinstance(e, aiohttp.ClientResponseError)
+                    and e.status < 500
+                    and e.status != 429
+                ) or attempt == self.retries:
+                    raise
+                await asyncio.sleep(self.retry_delay * 2**attempt)
+
+        if self.cache is not None:
+            self.cache.put(key, utterances)
+        return utterances
@@ -1,16 +1,129 @@
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from operator import truediv
+from typing import Iterator, List, Tuple
+
 import ffmpeg
 import numpy as np
 
 
+class AudioProfile:
+    def __init__(
+        self,
+        format: str,
+        mimetype: str,
+        codec: str = None,
+        sample_rate: int = None,
+        channels: int = None,
+        bitrate: str = None,
+    ) -> None:
+        self.format = format
+        self.mimetype = mimetype
+        self.codec = codec
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.bitrate = bitrate
+
+    @property
+    def output_args(self) -> dict:
+        args = {
+            "format": self.format,
+            "acodec": self.codec,
+            "ar": self.sample_rate,
+            "ac": self.channels,
+            "audio_bitrate": self.bitrate,
+        }
+        return {key: value for key, value in args.items() if value is not None}
+
+
+AUDIO_PROFILES = {
+    # Uncompressed, at the source sample rate and channel count.
+    "wav": AudioProfile("wav", "audio/wav"),
+    "pcm16k": AudioProfile(
+        "wav", "audio/wav", codec="pcm_s16le", sample_rate=16000, channels=1
+    ),
+    "flac": AudioProfile("flac", "audio/flac", sample_rate=16000, channels=1),
+    "opus": AudioProfile(
+        "ogg",
+        "audio/ogg",
+        codec="libopus",
+        sample_rate=16000,
+        channels=1,
+        bitrate="24k",
+    ),
+}
+TRANSCRIPTION_AUDIO_PROFILE = "flac"
+# Raw samples, for analysing the audio before it is encoded.
+PCM_AUDIO_PROFILE = AudioProfile(
+    "s16le", "audio/l16", codec="pcm_s16le", sample_rate=16000, channels=1
+)
+
+
+class SceneIndex:
+    """
+    Shot boundaries of a video, stored as the index of the first frame of each shot.
+    Cuts are found from the distance between the intensity histograms of consecutive
+    frames, usually computed on thumbnails as they are decoded.
+    """
+
+    CUT_THRESHOLD = 0.4
+    HISTOGRAM_BINS = 32
+
+    def __init__(self, boundaries: List[int], fps: int, frame_count: int) -> None:
+        self.boundaries = np.asarray(boundaries, dtype=np.int64)
+        self.fps = fps
+        self.frame_count = frame_count
+
+    @classmethod
+    def cut_scores(cls, frames: np.ndarray) -> np.ndarray:
+        """Total variation distance between the histograms of consecutive frames."""
+        count = len(frames)
+        bins = frames.reshape(count, -1) // (256 // cls.HISTOGRAM_BINS)
+        offsets = bins + (np.arange(count) * cls.HISTOGRAM_BINS)[:, None]
+        histograms = np.bincount(
+            offsets.ravel(), minlength=count * cls.HISTOGRAM_BINS
+        ).reshape(count, cls.HISTOGRAM_BINS) / (bins.shape[1])
+
+        return np.abs(np.diff(histograms, axis=0)).sum(axis=1) / 2
+
+    @classmethod
+    def is_cut(cls, previous: np.ndarray, current: np.ndarray) -> bool:
+        return cls.cut_scores(np.stack([previous, current]))[0] > cls.CUT_THRESHOLD
+
+    def __len__(self) -> int:
+        return len(self.boundaries)
+
+    def shot_of_frame(self, index: int) -> int:
+        return int(np.searchsorted(self.boundaries, index, side="right")) - 1
+
+    def shot_at(self, timestamp: float) -> int:
+        return self.shot_of_frame(int(timestamp * self.fps))
+
+    def shot_bounds(self, shot: int) -> Tuple[float, float]:
+        """Start and end timestamps of the shot."""
+        end = self.boundaries[shot + 1] if shot + 1 < len(self) else self.frame_count
+        return float(self.boundaries[shot] / self.fps), float(end / self.fps)
+
+
 class Video:
     def __init__(
         self,
         path: str,
         fps: int = 1,
         audio_only: bool = False,
+        lazy: bool = False,
+        memory_map: bool = False,
+        audio_profile: str = TRANSCRIPTION_AUDIO_PROFILE,
+        with_audio: bool = True,
+        max_duration: float = 120,
     ):
+        """Lazy videos decode frames on demand."""
+        self.path = path
         self.fps = fps
+        self.lazy = lazy
+        self.audio_profile = AUDIO_PROFILES[audio_profile]
 
         probe = ffmpeg.probe(path)
         self.video_info = next(
@@ -26,42 +139,305 @@ class Video:
 
         if self.fps > truediv(*map(int, self.video_info["avg_frame_rate"].split("/"))):
             raise RuntimeError("Specified fps higher than raw")
-        if float(self.video_info["duration"]) > 120:
-            raise RuntimeError("Video longer than 120 seconds")
+        if float(self.video_info["duration"]) > max_duration:
+            raise RuntimeError(f"Video longer than {max_duration} seconds")
+
+        self.height = self.video_info["height"]
+        self.width = self.video_info["width"]
 
-        if not audio_only:
+        self.frame_count = max(round(float(self.video_info["duration"]) * self.fps), 1)
+        self.audio = None
+        if not audio_only and not lazy and not with_audio:
             self.frames = self.load_frames(
-                path, self.video_info["height"], self.video_info["width"], self.fps
+                path,
+                self.height,
+                self.width,
+                self.fps,
+                expected_count=self.frame_count,
+                memory_map=memory_map,
             )
-        self.audio = self.load_audio(path)
+            self.frame_count = len(self.frames)
+        elif not audio_only and not lazy:
+            # Probe metadata is reused, and the input is only parsed and decoded once.
+            self.frames, self.audio = self.demux(
+                path,
+                self.height,
+                self.width,
+                self.fps,
+                expected_count=self.frame_count,
+                memory_map=memory_map,
+                audio_profile=self.audio_profile,
+            )
+            self.frame_count = len(self.frames)
+        elif with_audio:
+            self.audio = self.load_audio(path, self.audio_profile)
 
     @staticmethod
-    def load_frames(path: str, height: int, width: int, fps: int) -> np.ndarray:
-        out, _ = (
+    def read_frames(
+        process: subprocess.Popen, height: int, width: int
+    ) -> Iterator[np.ndarray]:
+        """Reads the decoded frames from the ffmpeg stdout pipe one at a time."""
+        frame_size = height * width * 3
+        exhausted = False
+
+        try:
+            while True:
+                buffer = process.stdout.read(frame_size)
+                if len(buffer) < frame_size:
+                    exhausted = True
+                    break
+                yield np.frombuffer(buffer, np.uint8).reshape([height, width, 3])
+        finally:
+            process.stdout.close()
+            # ffmpeg may still be writing other outputs once the frames are read.
+            if not exhausted:
+                process.kill()
+            err = process.stderr.read()
+            process.stderr.close()
+            # ffmpeg fails on the closed pipe when the reader stops early.
+            if process.wait() != 0 and exhausted:
+                raise ffmpeg.Error("ffmpeg", None, err)
+
+    @staticmethod
+    def store_frames(
+        frames: Iterator[np.ndarray],
+        height: int,
+        width: int,
+        expected_count: int = 1,
+        memory_map: bool = False,
+    ) -> np.ndarray:
+        """
+        Collects streamed frames into a preallocated array, or into a memory-mapped
+        file if `memory_map` is set, so that the raw video is never buffered twice.
+        """
+        if memory_map:
+            store = tempfile.TemporaryFile(prefix="frames")
+            count = 0
+            for frame in frames:
+                store.write(frame)
+                count += 1
+            store.flush()
+
+            if count == 0:
+                return np.empty([0, height, width, 3], np.uint8)
+            return np.memmap(
+                store, dtype=np.uint8, mode="r", shape=(count, height, width, 3)
+            )
+
+        out = np.empty([max(expected_count, 1), height, width, 3], np.uint8)
+        count = 0
+        for frame in frames:
+            if count == len(out):
+                out = np.concatenate([out, np.empty_like(out)])
+            out[count] = frame
+            count += 1
+
+        return out[:count]
+
+    @staticmethod
+    def iter_frames(
+        path: str, height: int, width: int, fps: int
+    ) -> Iterator[np.ndarray]:
+        process = (
             ffmpeg.input(path)
             .filter("fps", fps)
             .filter("scale", width, height)
             .output("pipe:", format="rawvideo", pix_fmt="bgr24")
+            .global_args("-loglevel", "error")
+            .run_async(pipe_stdout=True, pipe_stderr=True)
+        )
+
+        return Video.read_frames(process, height, width)
+
+    @staticmethod
+    def load_frames(
+        path: str,
+        height: int,
+        width: int,
+        fps: int,
+        expected_count: int = 1,
+        memory_map: bool = False,
+    ) -> np.ndarray:
+        return Video.store_frames(
+            Video.iter_frames(path, height, width, fps),
+            height,
+            width,
+            expected_count=expected_count,
+            memory_map=memory_map,
+        )
+
+    @staticmethod
+    def demux(
+        path: str,
+        height: int,
+        width: int,
+        fps: int,
+        expected_count: int = 1,
+        memory_map: bool = False,
+        audio_profile: AudioProfile = AUDIO_PROFILES["wav"],
+    ) -> Tuple[np.ndarray, bytes]:
+        """
+        Decodes the frames and the audio with a single ffmpeg process: frames are
+        streamed over stdout, while the audio is written to a second pipe.
+
+        Only eager videos use it. The comic pipeline decodes the audio separately, as
+        ffmpeg stops writing the audio while the frame reader is behind, which would
+        hold back the transcription request until the frames were scanned.
+        """
+        audio_read_fd, audio_write_fd = os.pipe()
+
+        stream = ffmpeg.input(path)
+        args = (
+            ffmpeg.merge_outputs(
+                stream.video.filter("fps", fps)
+                .filter("scale", width, height)
+                .output("pipe:1", format="rawvideo", pix_fmt="bgr24"),
+                stream.audio.output(
+                    f"pipe:{audio_write_fd}", **audio_profile.output_args
+                ),
+            )
+            .global_args("-loglevel", "error")
+            .compile()
+        )
+
+        try:
+            process = subprocess.Popen(
+                args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                pass_fds=(audio_write_fd,),
+            )
+        finally:
+            os.close(audio_write_fd)
+
+        with open(audio_read_fd, "rb") as audio_pipe, ThreadPoolExecutor(1) as pool:
+            audio = pool.submit(audio_pipe.read)
+            frames = Video.store_frames(
+                Video.read_frames(process, height, width),
+                height,
+                width,
+                expected_count=expected_count,
+                memory_map=memory_map,
+            )
+
+            return frames, audio.result()
+
+    @staticmethod
+    def load_frame(path: str, height: int, width: int, timestamp: float) -> np.ndarray:
+        """Decodes the single frame at `timestamp` using input seeking."""
+        out, _ = (
+            ffmpeg.input(path, ss=timestamp)
+            .filter("scale", width, height)
+            .output("pipe:", vframes=1, format="rawvideo", pix_fmt="bgr24")
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+
+        return np.frombuffer(out, np.uint8).reshape([height, width, 3])
+
+    @staticmethod
+    def load_frames_at(
+        path: str, height: int, width: int, fps: int, indices: list
+    ) -> Iterator[np.ndarray]:
+        """
+        Streams only the frames at the given (sorted, unique) indices of the `fps`
+        sampled stream from a single ffmpeg call, using a select filter.
+        """
+        if not indices:
+            return
+
+        process = (
+            ffmpeg.input(path, t=(indices[-1] + 1) / fps)
+            .filter("fps", fps)
+            .filter("select", "+".join(f"eq(n,{index})" for index in indices))
+            .filter("scale", width, height)
+            .output("pipe:", format="rawvideo", pix_fmt="bgr24", vsync=0)
+            .global_args("-loglevel", "error")
+            .run_async(pipe_stdout=True, pipe_stderr=True)
+        )
+
+        yield from Video.read_frames(process, height, width)
+
+    @staticmethod
+    def load_frame_range(
+        path: str, height: int, width: int, fps: int, start_time: float, count: int
+    ) -> np.ndarray:
+        out, _ = (
+            ffmpeg.input(path, ss=start_time)
+            .filter("fps", fps)
+            .filter("scale", width, height)
+            .output("pipe:", vframes=count, format="rawvideo", pix_fmt="bgr24")
             .run(capture_stdout=True, capture_stderr=True)
         )
 
         return np.frombuffer(out, np.uint8).reshape([-1, height, width, 3])
 
     @staticmethod
-    def load_audio(path) -> bytes:
+    def load_audio(path, audio_profile: AudioProfile = AUDIO_PROFILES["wav"]) -> bytes:
         out, _ = (
             ffmpeg.input(path)
-            .output("-", format="wav")
+            .audio.output("-", **audio_profile.output_args)
             .run(capture_stdout=True, capture_stderr=True)
         )
 
         return out
 
+    @staticmethod
+    def encode_audio(
+        pcm: bytes,
+        audio_profile: AudioProfile,
+        source_profile: AudioProfile = PCM_AUDIO_PROFILE,
+    ) -> bytes:
+        """Encodes raw samples, e.g. a chunk of `load_audio`'s, with the profile."""
+        out, _ = (
+            ffmpeg.input(
+                "pipe:",
+                format=source_profile.format,
+                ar=source_profile.sample_rate,
+                ac=source_profile.channels,
+            )
+            .output("-", **audio_profile.output_args)
+            .run(input=pcm, capture_stdout=True, capture_stderr=True)
+        )
+
+        return out
+
+    def get_frame_indices(self, start_time: float, end_time: float) -> range:
+        """Indices of the frames between the timestamps, at least one frame."""
+        start = min(int(start_time * self.fps), self.frame_count - 1)
+        end = min(int(end_time * self.fps), self.frame_count)
+        if end <= start:
+            return range(start, start + 1)
+        return range(start, end)
+
+    def get_frame_ranges(
+        self, start_times: np.ndarray, end_times: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """`get_frame_indices` for arrays of timestamps, as arrays of starts and stops."""
+        starts = np.minimum(
+            (start_times * self.fps).astype(np.int64), self.frame_count - 1
+        )
+        stops = np.minimum((end_times * self.fps).astype(np.int64), self.frame_count)
+        return starts, np.maximum(stops, starts + 1)
+
+    def get_frame(self, index: int) -> np.ndarray:
+        if not self.lazy:
+            return self.frames[index]
+
+        return self.load_frame(self.path, self.height, self.width, index / self.fps)
+
     def get_frames(self, start_time: float, end_time: float) -> np.ndarray:
-        frames = self.frames[int(start_time * self.fps) : int(end_time * self.fps)]
-        if len(frames) != 0:
-            return frames
-        return np.array([self.frames[int(start_time * self.fps)]])
+        indices = self.get_frame_indices(start_time, end_time)
+        if not self.lazy:
+            return self.frames[indices.start : indices.stop]
+
+        return self.load_frame_range(
+            self.path,
+            self.height,
+            self.width,
+            self.fps,
+            indices.start / self.fps,
+            len(indices),
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The modules are imported from src, as they are by the server.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from audio_chunker import MIN_CHUNK_LENGTH, chunk_bounds
+
+SAMPLE_RATE = 16000
+
+
+def noise(seconds: float, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.integers(-8000, 8000, int(seconds * SAMPLE_RATE), dtype=np.int16)
+
+
+def assert_covering(bounds, samples):
+    assert bounds[0][0] == 0
+    assert bounds[-1][1] == len(samples)
+    for (start, end), (next_start, next_end) in zip(bounds, bounds[1:]):
+        assert start < next_start < end < next_end
+
+
+@pytest.mark.parametrize("chunk_length", [MIN_CHUNK_LENGTH, 20, 60])
+def test_chunks_cover_noise_with_small_overlap(chunk_length):
+    samples = noise(200)
+    bounds = chunk_bounds(samples, SAMPLE_RATE, chunk_length)
+
+    assert_covering(bounds, samples)
+    lengths = [(end - start) / SAMPLE_RATE for start, end in bounds]
+    assert min(lengths[:-1]) > chunk_length / 2
+    assert max(lengths) <= chunk_length + 0.1
+
+    transcribed = sum(lengths)
+    assert transcribed < 200 * 1.2
+
+
+def test_chunks_end_in_silences():
+    samples = noise(130)
+    for silence in (52, 100):
+        samples[silence * SAMPLE_RATE : (silence + 1) * SAMPLE_RATE] = 0
+
+    bounds = chunk_bounds(samples, SAMPLE_RATE, 60)
+
+    assert_covering(bounds, samples)
+    assert len(bounds) == 3
+    for (_, end), silence in zip(bounds, (52, 100)):
+        assert silence <= end / SAMPLE_RATE <= silence + 1
+
+
+def test_short_audio_is_one_chunk():
+    samples = noise(30)
+    assert chunk_bounds(samples, SAMPLE_RATE, 60) == [(0, len(samples))]
+
+
+@pytest.mark.parametrize("length", [0, 100])
+def test_audio_shorter_than_a_window_is_one_chunk(length):
+    samples = np.zeros(length, np.int16)
+    assert chunk_bounds(samples, SAMPLE_RATE, 60) == [(0, length)]
+
+
+@pytest.mark.parametrize("chunk_length", [0.5, 5, MIN_CHUNK_LENGTH - 1])
+def test_short_chunks_are_rejected(chunk_length):
+    with pytest.raises(ValueError):
+        chunk_bounds(noise(60), SAMPLE_RATE, chunk_length)
+
+
+def test_overlap_that_would_not_advance_is_rejected():
+    with pytest.raises(ValueError):
+        chunk_bounds(noise(60), SAMPLE_RATE, 20, overlap=5, search=10)
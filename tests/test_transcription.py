@@ -0,0 +1,46 @@
+from transcription import stitch_utterances
+
+
+def utterance(start, end, speaker, transcript=""):
+    return {"start": start, "end": end, "transcript": transcript, "speaker": speaker}
+
+
+def test_single_chunk_is_offset():
+    chunks = [(30, 60, [utterance(1, 2, 0, "a"), utterance(3, 4, 1, "b")])]
+
+    assert stitch_utterances(chunks) == [
+        utterance(31, 32, 0, "a"),
+        utterance(33, 34, 1, "b"),
+    ]
+
+
+def test_speakers_are_matched_in_the_overlap():
+    chunks = [
+        (0, 60, [utterance(0, 10, 0, "a"), utterance(50, 58, 1, "b")]),
+        # Labels differ between chunks: speaker 1 of the first is 0 here.
+        (55, 120, [utterance(0, 3, 0, "b"), utterance(10, 20, 0, "c")]),
+    ]
+
+    assert stitch_utterances(chunks) == [
+        utterance(0, 10, 0, "a"),
+        utterance(50, 58, 1, "b"),
+        utterance(65, 75, 1, "c"),
+    ]
+
+
+def test_unmatched_speakers_get_new_labels():
+    chunks = [
+        (0, 60, [utterance(50, 58, 0, "a")]),
+        (55, 120, [utterance(0, 3, 1, "a"), utterance(10, 20, 0, "b")]),
+    ]
+
+    assert [u["speaker"] for u in stitch_utterances(chunks)] == [0, 1]
+
+
+def test_duplicates_in_the_overlap_are_dropped():
+    chunks = [
+        (0, 60, [utterance(56, 59, 0, "a")]),
+        (55, 120, [utterance(1, 4, 0, "a"), utterance(4.5, 6, 0, "b")]),
+    ]
+
+    assert [u["transcript"] for u in stitch_utterances(chunks)] == ["a", "b"]